@@ -5,21 +5,253 @@ import json
 import pwd
 import shutil
 import re
-from datetime import datetime
+import csv
+import decimal
+import time
+import threading
+import hashlib
+import uuid
+import secrets
+import multiprocessing
+import atexit
+import fcntl
+import errno
+import sqlite3
+import queue
+import tempfile
+import gzip
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
 from functools import wraps
-from flask import Flask, render_template, request, jsonify, send_file
+import pymysql
+from flask import Flask, Response, g, render_template, request, jsonify, make_response, stream_with_context
 from io import StringIO
 
 app = Flask(__name__)
 
+# Part of the dashboard ETag, so a changed template is never served from browser cache
+TEMPLATE_STAMP = int(os.path.getmtime(os.path.join(app.root_path, 'templates', 'index.html')))
+
 # Data storage
-DATA_FILE = '/var/lib/user_manager_data.json'
-LOG_FILE = '/var/lib/user_manager_actions.log'
+DATA_FILE = '/var/lib/user_manager_data.json'  # Legacy JSON state, migrated into STATE_DB_FILE
+STATE_DB_FILE = os.environ.get('USER_MANAGER_STATE_DB', '/var/lib/user_manager_state.db')
+LOG_FILE = '/var/lib/user_manager_actions.log'  # Legacy JSON log, migrated into LOG_DIR
+LOG_DIR = '/var/lib/user_manager_audit'
+LOG_SEGMENT_MAX_BYTES = int(os.environ.get('USER_MANAGER_LOG_SEGMENT_BYTES', str(4 * 1024 * 1024)))
+LOG_MAX_SEGMENTS = int(os.environ.get('USER_MANAGER_LOG_MAX_SEGMENTS', '500'))
+LOG_INDEX_INTERVAL = 128  # One offset index entry per this many log entries
+PASSWD_FILE = '/etc/passwd'
+SHADOW_FILE = '/etc/shadow'
+SSHD_CONFIG_FILE = '/etc/ssh/sshd_config'
+
+# Seconds to wait for more changes before rewriting AllowUsers and reloading sshd
+SSH_UPDATE_WINDOW = float(os.environ.get('USER_MANAGER_SSH_UPDATE_WINDOW', '2'))
+
+# Database connection settings (override via environment, e.g. to point at a test server)
+DB_HOST = os.environ.get('USER_MANAGER_DB_HOST', 'localhost')
+DB_PORT = int(os.environ.get('USER_MANAGER_DB_PORT', '3306'))
+DB_SOCKET = os.environ.get('USER_MANAGER_DB_SOCKET', '')
+DB_USER = os.environ.get('USER_MANAGER_DB_USER', 'root')
+DB_PASSWORD = os.environ.get('USER_MANAGER_DB_PASSWORD', '')
+DB_POOL_SIZE = int(os.environ.get('USER_MANAGER_DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.environ.get('USER_MANAGER_DB_POOL_TIMEOUT', '10'))
+DB_PING_INTERVAL = float(os.environ.get('USER_MANAGER_DB_PING_INTERVAL', '30'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('USER_MANAGER_DB_CONNECT_TIMEOUT', '5'))
+DB_READ_TIMEOUT = int(os.environ.get('USER_MANAGER_DB_READ_TIMEOUT', '300'))
+DB_STATEMENT_TIMEOUT = float(os.environ.get('USER_MANAGER_DB_STATEMENT_TIMEOUT', '30'))
+
+# Background DB size sampler: page renders read the latest sample, never information_schema
+DB_SIZE_HISTORY_FILE = '/var/lib/user_manager_db_sizes.jsonl'
+DB_SIZE_SAMPLE_INTERVAL = float(os.environ.get('USER_MANAGER_DB_SIZE_INTERVAL', '300'))
+DB_SIZE_HISTORY_SAMPLES = int(os.environ.get('USER_MANAGER_DB_SIZE_SAMPLES', '8640'))  # 30 days at 5 minutes
+DB_SIZE_KEYFRAME_EVERY = 288
+
+# Cached DB sizes in the user inventory are refreshed after this many seconds
+INVENTORY_DB_SIZE_TTL = float(os.environ.get('USER_MANAGER_DB_SIZE_TTL', '60'))
+INVENTORY_CHANGE_HISTORY = int(os.environ.get('USER_MANAGER_INVENTORY_HISTORY', '256'))
+
+# Server-sent events (/events): open dashboards, keepalive interval and per-client backlog
+EVENT_MAX_CLIENTS = int(os.environ.get('USER_MANAGER_EVENT_CLIENTS', '32'))
+EVENT_KEEPALIVE = float(os.environ.get('USER_MANAGER_EVENT_KEEPALIVE', '15'))
+EVENT_QUEUE_SIZE = 256
+
+# Background jobs for long-running operations (?async=1)
+JOB_WORKERS = int(os.environ.get('USER_MANAGER_JOB_WORKERS', '2'))
+JOB_RETENTION_SECONDS = int(os.environ.get('USER_MANAGER_JOB_RETENTION', '3600'))
+
+# Per-user provisioning steps run on up to this many threads; each holds a pooled DB
+# connection, so more threads than DB_POOL_SIZE would only wait for (and time out on) the pool
+PROVISION_WORKERS = min(int(os.environ.get('USER_MANAGER_PROVISION_WORKERS', str(os.cpu_count() or 4))), DB_POOL_SIZE)
+
+# Database backups: dumps run on this many workers, each streamed through gzip to disk
+BACKUP_DIR = os.environ.get('USER_MANAGER_BACKUP_DIR', '/var/backups/user_manager')
+BACKUP_WORKERS = int(os.environ.get('USER_MANAGER_BACKUP_WORKERS', '4'))
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get('USER_MANAGER_BACKUP_COMPRESSION', '6'))
+# Archive a user's database before deleting it (also per request with ?archive=1)
+ARCHIVE_ON_DELETE = os.environ.get('USER_MANAGER_ARCHIVE_ON_DELETE', '').lower() in ('1', 'true', 'yes', 'on')
+
+# Streamed JSONL/CSV rosters are provisioned this many users at a time
+INGEST_CHUNK_SIZE = int(os.environ.get('USER_MANAGER_INGEST_CHUNK', '1000'))
+INGEST_FORMATS = {'.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+INGEST_CONTENT_TYPES = {'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl', 'text/csv': 'csv'}
+
+# Password hashing for bulk rotation runs on this many processes (CPU-bound)
+HASH_WORKERS = int(os.environ.get('USER_MANAGER_HASH_WORKERS', str(os.cpu_count() or 4)))
+HASH_INLINE_BELOW = 32  # Smaller batches are hashed in-process; starting workers costs more
+GENERATED_PASSWORD_LENGTH = 14
+
+# useradd/userdel/usermod/chpasswd/newusers all take the /etc/passwd and /etc/shadow
+# locks and fail with "cannot lock /etc/passwd" when they overlap, so run them one at a time
+PASSWD_LOCK = threading.RLock()
+LOG_LOCK = threading.Lock()
+
+# Instrumentation: operations slower than this are appended to SLOW_OP_LOG (0 disables)
+SLOW_OP_LOG = os.environ.get('USER_MANAGER_SLOW_OP_LOG', '/var/lib/user_manager_slow_ops.log')
+SLOW_OP_THRESHOLD_MS = float(os.environ.get('USER_MANAGER_SLOW_OP_MS', '1000'))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    """Thread-safe histograms, counters and gauges rendered in Prometheus text format"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (metric, labels) -> [bucket counts..., sum, count]
+        self._counters = {}
+        self._gauges = {}
+        self._help = {}
+
+    def describe(self, metric, kind, text):
+        self._help[metric] = (kind, text)
+
+    def observe(self, metric, labels, value):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def inc(self, metric, labels, amount=1):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_gauge(self, metric, labels, amount):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def render(self, extra_gauges=()):
+        """Exposition text; `extra_gauges` are (metric, labels, value) sampled at scrape time"""
+        with self._lock:
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        for metric, labels, value in extra_gauges:
+            gauges[(metric, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        def header(metric, default_kind):
+            kind, text = self._help.get(metric, (default_kind, ''))
+            if text:
+                lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} {kind}")
+
+        for metric in sorted({k[0] for k in histograms}):
+            header(metric, 'histogram')
+            for (name, labels), series in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for i, bound in enumerate(self.buckets):
+                    lines.append(f"{metric}_bucket{format_labels(labels + (('le', str(bound)),))} {series[i]}")
+                lines.append(f"{metric}_bucket{format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {series[-2]:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {series[-1]}")
+        for values, default_kind in ((counters, 'counter'), (gauges, 'gauge')):
+            for metric in sorted({k[0] for k in values}):
+                header(metric, default_kind)
+                for (name, labels), value in sorted(values.items()):
+                    if name == metric:
+                        lines.append(f"{metric}{format_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+METRICS = Metrics(METRICS_BUCKETS)
+METRICS.describe('user_manager_http_request_duration_seconds', 'histogram', 'Request latency by route, method and status')
+METRICS.describe('user_manager_http_requests_in_flight', 'gauge', 'Requests currently being handled')
+METRICS.describe('user_manager_operation_duration_seconds', 'histogram', 'Latency of external commands, file and SQL operations')
+METRICS.describe('user_manager_operation_failures_total', 'counter', 'Operations that raised or exited non-zero')
+METRICS.describe('user_manager_operations_in_flight', 'gauge', 'Operations currently running')
+METRICS.describe('user_manager_slow_operations_total', 'counter', 'Operations slower than USER_MANAGER_SLOW_OP_MS')
+METRICS.describe('user_manager_db_pool_connections', 'gauge', 'Pooled database connections by state')
+METRICS.describe('user_manager_query_cache_bytes', 'gauge', 'Bytes held by the shared query result cache')
+METRICS.describe('user_manager_query_cache_lookups', 'gauge', 'Query cache lookups since start by result')
+METRICS.describe('user_manager_ssh_updates_pending', 'gauge', 'AllowUsers updates waiting for the coalescing window')
+METRICS.describe('user_manager_jobs', 'gauge', 'Retained background jobs by state')
+METRICS.describe('user_manager_event_clients', 'gauge', 'Open /events streams')
+METRICS.describe('user_manager_quarantine_pending', 'gauge', 'Deleted home directories waiting for the reaper')
+SLOW_OP_LOCK = threading.Lock()
+
+def record_slow_operation(kind, name, seconds, failed):
+    METRICS.inc('user_manager_slow_operations_total', {'kind': kind})
+    entry = {'timestamp': datetime.now().isoformat(), 'kind': kind, 'name': name,
+             'duration_ms': round(seconds * 1000, 1), 'failed': failed}
+    try:
+        with SLOW_OP_LOCK, open(SLOW_OP_LOG, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"[!] Could not write slow operation log: {e}")
+
+class TimedOperation:
+    """Outcome holder for timed(); set `failed` for failures that don't raise"""
+    failed = False
+
+@contextmanager
+def timed(kind, name):
+    """Record latency, failures and in-flight count for one command/file/SQL operation"""
+    labels = {'kind': kind, 'name': name}
+    op = TimedOperation()
+    METRICS.add_gauge('user_manager_operations_in_flight', labels, 1)
+    started = time.perf_counter()
+    try:
+        yield op
+    except Exception:
+        op.failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        METRICS.add_gauge('user_manager_operations_in_flight', labels, -1)
+        METRICS.observe('user_manager_operation_duration_seconds', labels, elapsed)
+        if op.failed:
+            METRICS.inc('user_manager_operation_failures_total', labels)
+        if SLOW_OP_THRESHOLD_MS and elapsed * 1000 >= SLOW_OP_THRESHOLD_MS:
+            record_slow_operation(kind, name, elapsed, op.failed)
+
+def run_command(args, **kwargs):
+    """subprocess.run with per-command latency and failure metrics"""
+    # Shell pipelines ("echo ... | chpasswd") are named after the command doing the work
+    name = os.path.basename(args.rsplit('|', 1)[-1].split()[0] if isinstance(args, str) else args[0])
+    with timed('command', name) as op:
+        result = subprocess.run(args, **kwargs)
+        op.failed = result.returncode != 0
+        return result
 
 # Security: Input validation
 def is_safe_input(value):
     """Only allow alphanumeric and underscore characters"""
-    if not value:
+    if not value or not isinstance(value, str):
         return False
     return re.match(r'^[a-zA-Z0-9_]+$', value) is not None
 
@@ -30,6 +262,9 @@ def is_safe_ip(value):
     # Basic IP validation: xxx.xxx.xxx.xxx or 0.0.0.0
     return re.match(r'^(\d{1,3}\.){3}\d{1,3}$', value) is not None
 
+# Privileges for working *inside* a shared database (cannot drop the database itself)
+SHARED_DB_PRIVILEGES = "SELECT, INSERT, UPDATE, DELETE, CREATE, DROP, ALTER, INDEX, REFERENCES, CREATE TEMPORARY TABLES, LOCK TABLES, EXECUTE, CREATE VIEW, SHOW VIEW, CREATE ROUTINE, ALTER ROUTINE, TRIGGER"
+
 def is_safe_sql_query(query):
     """Basic SQL query validation - only allow SELECT, INSERT, UPDATE, DELETE, SHOW, DESCRIBE"""
     if not query:
@@ -54,153 +289,1095 @@ def root_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {'shared_dbs': []}
+# Database access layer: pooled in-process connections instead of one mysql process per statement
+def detect_mariadb_socket():
+    """Detect MariaDB unix socket location"""
+    possible_paths = [
+        '/var/lib/mysql/mysql.sock',                   # Rocky Linux/RHEL/CentOS
+        '/run/mysqld/mysqld.sock',                     # Debian/Ubuntu
+        '/var/run/mysqld/mysqld.sock',
+        '/tmp/mysql.sock'
+    ]
 
-def save_data(data):
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
+    for path in possible_paths:
+        if os.path.exists(path):
+            return path
 
-def log_action(action, username, result):
-    """Persistent file-based logging"""
-    log_entry = {
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'action': action,
-        'username': username,
-        'result': result
+    return None
+
+def connect_db():
+    """Open a new server connection (root over the unix socket, like the mysql client)"""
+    kwargs = {
+        'user': DB_USER,
+        'password': DB_PASSWORD,
+        'charset': 'utf8mb4',
+        'autocommit': True,
+        'connect_timeout': DB_CONNECT_TIMEOUT,
+        'read_timeout': DB_READ_TIMEOUT,
+        'write_timeout': DB_READ_TIMEOUT
     }
-    
+    socket_path = DB_SOCKET or (detect_mariadb_socket() if DB_HOST == 'localhost' else None)
+    if socket_path:
+        kwargs['unix_socket'] = socket_path
+    else:
+        kwargs['host'] = DB_HOST
+        kwargs['port'] = DB_PORT
+    conn = pymysql.connect(**kwargs)
+    conn.is_mariadb = 'MariaDB' in conn.get_server_info()
+    conn.statement_timeout = None
+    conn.current_db = None
+    return conn
+
+def is_connection_error(e):
+    """True for client-side errors (lost connection, timeouts); server error codes are below 2000"""
+    code = e.args[0] if e.args else None
+    return isinstance(e, pymysql.err.InterfaceError) or not isinstance(code, int) or code >= 2000
+
+class ConnectionPool:
+    """Bounded pool of server connections with health checks on checkout"""
+
+    def __init__(self, connect, max_size, acquire_timeout, ping_interval):
+        self.connect = connect
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.ping_interval = ping_interval
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("Timed out waiting for a database connection")
+        conn = None
+        try:
+            conn = self._checkout()
+            with self._lock:
+                self._in_use += 1
+            yield conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+            # Connection-level failure: never hand this connection out again
+            if is_connection_error(e):
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+            with self._lock:
+                self._in_use = max(0, self._in_use - 1)
+            self._slots.release()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return self.connect()
+            conn, last_used = item
+            if time.monotonic() - last_used < self.ping_interval:
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except Exception:
+                self._discard(conn)
+
+    def _discard(self, conn):
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {'max_size': self.max_size, 'idle': len(self._idle), 'in_use': self._in_use}
+
+DB_POOL = ConnectionPool(connect_db, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_PING_INTERVAL)
+
+def _prepare_connection(conn, database, timeout):
+    """Select the database and apply the per-statement timeout (server-side kill)"""
+    if database and conn.current_db != database:
+        conn.select_db(database)
+        conn.current_db = database
+    if timeout != conn.statement_timeout:
+        with conn.cursor() as cursor:
+            if conn.is_mariadb:
+                cursor.execute("SET SESSION max_statement_time = %s", (timeout or 0,))
+            else:
+                cursor.execute("SET SESSION max_execution_time = %s", (int((timeout or 0) * 1000),))
+        conn.statement_timeout = timeout
+
+# Administrative batches (CREATE/DROP DATABASE, GRANT, DROP USER) run without a statement
+# timeout: max_statement_time also covers DDL on MariaDB, and aborting a large DROP halfway
+# leaves it partly applied
+ADMIN_BATCH_TIMEOUT = 0
+
+def db_execute(sql, args=None, database=None, timeout=None):
+    """Run one statement on a pooled connection; returns (column names or None, rows)"""
+    if timeout is None:
+        timeout = DB_STATEMENT_TIMEOUT
+    with timed('sql', sql.lstrip().split(None, 1)[0].upper()), DB_POOL.connection() as conn:
+        _prepare_connection(conn, database, timeout)
+        with conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            if cursor.description is None:
+                return None, []
+            columns = [col[0] for col in cursor.description]
+            return columns, list(cursor.fetchall())
+
+def db_query(sql, args=None, database=None, timeout=None):
+    """Run one statement and return its rows"""
+    return db_execute(sql, args, database, timeout)[1]
+
+def db_execute_script(statements, database=None, timeout=None):
+    """Run several statements in order on one connection, stopping at the first error.
+
+    Each statement is either a SQL string or a (sql, args) tuple. No statement
+    timeout by default (see ADMIN_BATCH_TIMEOUT).
+    """
+    if timeout is None:
+        timeout = ADMIN_BATCH_TIMEOUT
+    with timed('sql', 'script'), DB_POOL.connection() as conn:
+        _prepare_connection(conn, database, timeout)
+        with conn.cursor() as cursor:
+            for statement in statements:
+                sql, args = statement if isinstance(statement, tuple) else (statement, None)
+                cursor.execute(sql, args)
+
+def db_execute_groups(groups, final=None, database=None, timeout=None):
+    """Run independent statement groups on one connection, isolating errors per group.
+
+    Returns one entry per group: None on success or the exception that stopped it.
+    The `final` statements (e.g. a single FLUSH PRIVILEGES) run once after all groups.
+    No statement timeout by default (see ADMIN_BATCH_TIMEOUT).
+    """
+    if timeout is None:
+        timeout = ADMIN_BATCH_TIMEOUT
+    errors = []
+    with timed('sql', 'groups'), DB_POOL.connection() as conn:
+        _prepare_connection(conn, database, timeout)
+        with conn.cursor() as cursor:
+            for statements in groups:
+                try:
+                    for statement in statements:
+                        sql, args = statement if isinstance(statement, tuple) else (statement, None)
+                        cursor.execute(sql, args)
+                    errors.append(None)
+                except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+                    # A server-side error leaves the connection usable, a lost connection does not
+                    if is_connection_error(e):
+                        raise
+                    errors.append(e)
+                except pymysql.err.MySQLError as e:
+                    errors.append(e)
+            for statement in final or []:
+                sql, args = statement if isinstance(statement, tuple) else (statement, None)
+                cursor.execute(sql, args)
+    return errors
+
+@contextmanager
+def statement_watchdog(conn, timeout):
+    """Kill the running statement from a second connection if it outlives `timeout`.
+
+    Backstop for statements the server-side max_statement_time does not cover
+    (e.g. writes on MySQL).
+    """
+    if not timeout:
+        yield
+        return
+    thread_id = conn.thread_id()
+
+    def kill():
+        try:
+            # A fresh connection: the pool may be exhausted by the statements being killed
+            killer = DB_POOL.connect()
+            try:
+                with killer.cursor() as cursor:
+                    cursor.execute("KILL QUERY %s", (thread_id,))
+            finally:
+                killer.close()
+        except Exception as e:
+            print(f"[!] Could not kill statement on connection {thread_id}: {db_error_message(e)}")
+
+    timer = threading.Timer(timeout + 1, kill)
+    timer.daemon = True
+    timer.start()
     try:
-        # Load existing logs
-        logs = []
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r') as f:
-                logs = json.load(f)
-        
-        # Append new log
-        logs.append(log_entry)
-        
-        # Keep only last 50 entries
-        if len(logs) > 50:
-            logs = logs[-50:]
-        
-        # Save back to file
-        os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-        with open(LOG_FILE, 'w') as f:
-            json.dump(logs, f, indent=2)
+        yield
+    finally:
+        timer.cancel()
+
+def is_statement_timeout(e):
+    """Statement interrupted by max_statement_time/max_execution_time or KILL QUERY"""
+    return isinstance(e, pymysql.err.OperationalError) and bool(e.args) and e.args[0] in (1317, 1969, 3024)
+
+def db_error_message(e):
+    """Server message from a driver error (the same text the mysql client prints)"""
+    if isinstance(e, pymysql.err.MySQLError) and len(e.args) > 1:
+        return str(e.args[1])
+    return str(e)
+
+def format_ascii_table(columns, rows):
+    """Render a result set the way `mysql -t` does"""
+    cells = [['NULL' if v is None else str(v) for v in row] for row in rows]
+    widths = [len(c) for c in columns]
+    for row in cells:
+        for i, value in enumerate(row):
+            widths[i] = max(widths[i], len(value))
+    border = '+' + '+'.join('-' * (w + 2) for w in widths) + '+'
+    def line(values):
+        return '| ' + ' | '.join(v.ljust(widths[i]) for i, v in enumerate(values)) + ' |'
+    output = [border, line(columns), border]
+    output.extend(line(row) for row in cells)
+    output.append(border)
+    return '\n'.join(output) + '\n'
+
+# App state (shared databases, grant assignments, metadata) lives in SQLite in WAL mode:
+# readers never block, and writers in any worker process serialize on BEGIN IMMEDIATE
+STATE_SCHEMA_VERSION = 2
+STATE_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS shared_dbs (name TEXT PRIMARY KEY, created_at TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS grants (db_name TEXT NOT NULL REFERENCES shared_dbs(name) ON DELETE CASCADE, "
+    "username TEXT NOT NULL, granted_at TEXT NOT NULL, PRIMARY KEY (db_name, username)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS grants_by_user ON grants (username, db_name)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    # v2: background jobs, so any worker process can answer /jobs/<id>
+    "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, key TEXT NOT NULL, "
+    "owner_pid INTEGER NOT NULL, state TEXT NOT NULL, status TEXT NOT NULL, total INTEGER NOT NULL, "
+    "completed INTEGER NOT NULL, message TEXT NOT NULL, outcome TEXT, created_at REAL NOT NULL, "
+    "started_at REAL, finished_at REAL)",
+    # At most one unfinished job per submission fingerprint, across all workers
+    "CREATE UNIQUE INDEX IF NOT EXISTS jobs_active_key ON jobs (key) WHERE finished_at IS NULL",
+    "CREATE TABLE IF NOT EXISTS job_results (job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE, "
+    "position INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, position)) WITHOUT ROWID"
+]
+STATE_LOCAL = threading.local()
+
+def state_db():
+    """This thread's connection to the state store (opened, migrated and cached on first use)"""
+    conn = getattr(STATE_LOCAL, 'conn', None)
+    # Connections must not cross a fork (e.g. gunicorn preload)
+    if conn is not None and STATE_LOCAL.pid == os.getpid() and STATE_LOCAL.path == STATE_DB_FILE:
+        return conn
+    os.makedirs(os.path.dirname(STATE_DB_FILE) or '.', exist_ok=True)
+    conn = sqlite3.connect(STATE_DB_FILE, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    if conn.execute("PRAGMA user_version").fetchone()[0] < STATE_SCHEMA_VERSION:
+        init_state_db(conn)
+    STATE_LOCAL.conn, STATE_LOCAL.pid, STATE_LOCAL.path = conn, os.getpid(), STATE_DB_FILE
+    return conn
+
+@contextmanager
+def state_transaction():
+    """Write transaction; BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic"""
+    conn = state_db()
+    with timed('file', 'state_db'):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+def init_state_db(conn):
+    """Create the schema and import the legacy JSON file once (safe to race between workers)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("PRAGMA user_version").fetchone()[0] < STATE_SCHEMA_VERSION:
+            for statement in STATE_SCHEMA:
+                conn.execute(statement)
+            migrated = migrate_legacy_data(conn)
+            conn.execute(f"PRAGMA user_version = {STATE_SCHEMA_VERSION}")
+        else:
+            migrated = None
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if migrated is not None:
+        os.rename(DATA_FILE, DATA_FILE + '.migrated')
+        print(f"[+] Migrated {migrated} shared databases from {DATA_FILE}")
+
+def migrate_legacy_data(conn):
+    """Import shared DBs from the JSON file and their current grants from the server"""
+    if not os.path.exists(DATA_FILE):
+        return None
+    with open(DATA_FILE, 'r') as f:
+        shared_dbs = [db for db in json.load(f).get('shared_dbs', []) if is_safe_input(db)]
+    now = datetime.now().isoformat()
+    conn.executemany("INSERT OR IGNORE INTO shared_dbs (name, created_at) VALUES (?, ?)", [(db, now) for db in shared_dbs])
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (now,))
+    if shared_dbs:
+        try:
+            placeholders = ', '.join(['%s'] * len(shared_dbs))
+            rows = db_query(f"SELECT Db, User FROM mysql.db WHERE Host = 'localhost' AND Db IN ({placeholders})", tuple(shared_dbs))
+            conn.executemany("INSERT OR IGNORE INTO grants (db_name, username, granted_at) VALUES (?, ?, ?)",
+                             [(db, user, now) for db, user in rows])
+        except Exception as e:
+            print(f"[!] Could not import existing grants: {db_error_message(e)}")
+    return len(shared_dbs)
+
+def list_shared_dbs():
+    return [row[0] for row in state_db().execute("SELECT name FROM shared_dbs ORDER BY created_at, name")]
+
+def add_shared_db(db_name):
+    """Record a shared database; returns False if it was already known"""
+    with state_transaction() as conn:
+        cursor = conn.execute("INSERT OR IGNORE INTO shared_dbs (name, created_at) VALUES (?, ?)",
+                              (db_name, datetime.now().isoformat()))
+        return cursor.rowcount == 1
+
+def record_grants(pairs):
+    """Record (db_name, username) grants; databases the app does not manage are ignored"""
+    now = datetime.now().isoformat()
+    with state_transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO grants (db_name, username, granted_at) "
+                         "SELECT name, ?, ? FROM shared_dbs WHERE name = ?",
+                         [(user, now, db) for db, user in pairs])
+
+def remove_grants(pairs):
+    with state_transaction() as conn:
+        conn.executemany("DELETE FROM grants WHERE db_name = ? AND username = ?", list(pairs))
+
+def remove_user_grants(usernames):
+    with state_transaction() as conn:
+        conn.executemany("DELETE FROM grants WHERE username = ?", [(u,) for u in usernames])
+
+def users_with_access(db_name):
+    rows = state_db().execute("SELECT username FROM grants WHERE db_name = ? ORDER BY username", (db_name,))
+    return [row[0] for row in rows]
+
+def get_shared_db_grants():
+    """{username: [shared databases the user was granted]}"""
+    grants = {}
+    for user, db in state_db().execute("SELECT username, db_name FROM grants ORDER BY username, db_name"):
+        grants.setdefault(user, []).append(db)
+    return grants
+
+# Audit log: append-only JSONL segments named after their first sequence number.
+# Each segment has a small .idx file with the byte offset of every
+# LOG_INDEX_INTERVAL-th entry, so pages can be read backwards without scanning history.
+LOG_TAIL_CACHE = {}
+
+def list_log_segments():
+    """[(first_seq, path)] of all segments, oldest first"""
+    segments = []
+    if os.path.isdir(LOG_DIR):
+        for name in os.listdir(LOG_DIR):
+            if name.startswith('segment-') and name.endswith('.jsonl'):
+                segments.append((int(name[len('segment-'):-len('.jsonl')]), os.path.join(LOG_DIR, name)))
+    return sorted(segments)
+
+def log_segment_path(first_seq):
+    return os.path.join(LOG_DIR, f'segment-{first_seq:012d}.jsonl')
+
+def read_log_index(path):
+    """[(seq, offset)] index points of a segment"""
+    points = []
+    try:
+        with open(path[:-len('.jsonl')] + '.idx', 'r') as f:
+            for line in f:
+                seq, offset = line.split()
+                points.append((int(seq), int(offset)))
+    except FileNotFoundError:
+        pass
+    return points
+
+def last_log_seq(first_seq, path, size):
+    """(seq, end offset) of the last complete entry in a segment.
+
+    Reads forward from the last index point, so only up to LOG_INDEX_INTERVAL entries of
+    any size are parsed. A torn final line (crash mid-append) is skipped; the returned
+    offset is where it starts.
+    """
+    cached = LOG_TAIL_CACHE.get(path)
+    if cached and cached[0] == size:
+        return cached[1], size
+    points = [(seq, offset) for seq, offset in read_log_index(path) if offset < size]
+    seq, offset = (points[-1][0] - 1, points[-1][1]) if points else (first_seq - 1, 0)
+    good_end = offset
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if not line.endswith(b'\n'):
+                break
+            try:
+                seq = json.loads(line)['seq']
+            except (ValueError, KeyError, TypeError):
+                continue
+            good_end = offset
+    return seq, good_end
+
+def truncate_torn_log_tail(path, size, good_end):
+    """Cut a partial last line off a segment so the next entry starts on its own line"""
+    with open(path, 'r+b') as f:
+        f.truncate(good_end)
+    points = read_log_index(path)
+    if points and points[-1][1] >= good_end:
+        with open(path[:-len('.jsonl')] + '.idx', 'w') as f:
+            f.writelines(f"{seq} {offset}\n" for seq, offset in points if offset < good_end)
+    print(f"[!] Dropped {size - good_end} bytes of incomplete audit log entry from {path}")
+
+def append_log_entries(entries):
+    """Append entries to the active segment (caller holds LOG_LOCK and the file lock)"""
+    segments = list_log_segments()
+    if segments:
+        first_seq, path = segments[-1]
+        size = os.path.getsize(path)
+        seq, good_end = last_log_seq(first_seq, path, size)
+        if good_end < size:
+            truncate_torn_log_tail(path, size, good_end)
+            size = good_end
+        seq += 1
+    else:
+        first_seq, path, size, seq = 1, log_segment_path(1), 0, 1
+
+    for entry in entries:
+        if size >= LOG_SEGMENT_MAX_BYTES:
+            # Rotate: start a new segment and drop the oldest beyond the retention limit
+            first_seq, path, size = seq, log_segment_path(seq), 0
+            segments.append((first_seq, path))
+            for _, old_path in segments[:-LOG_MAX_SEGMENTS]:
+                for stale in (old_path, old_path[:-len('.jsonl')] + '.idx'):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                LOG_TAIL_CACHE.pop(old_path, None)
+            segments = segments[-LOG_MAX_SEGMENTS:]
+        entry['seq'] = seq
+        line = (json.dumps(entry) + '\n').encode('utf-8')
+        with open(path, 'ab') as f:
+            f.write(line)
+        if (seq - first_seq) % LOG_INDEX_INTERVAL == 0:
+            with open(path[:-len('.jsonl')] + '.idx', 'a') as f:
+                f.write(f"{seq} {size}\n")
+        size += len(line)
+        LOG_TAIL_CACHE[path] = (size, seq)
+        seq += 1
+
+@contextmanager
+def audit_log_lock():
+    """Serialize appends across threads and across worker processes"""
+    with LOG_LOCK:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        with open(os.path.join(LOG_DIR, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def migrate_legacy_log():
+    """Import the old JSON array log once (caller holds the audit log lock)"""
+    if list_log_segments() or not os.path.exists(LOG_FILE):
+        return
+    try:
+        with open(LOG_FILE, 'r') as f:
+            legacy = json.load(f)
+        append_log_entries([e for e in legacy if isinstance(e, dict)])
+        os.rename(LOG_FILE, LOG_FILE + '.migrated')
+        print(f"[+] Migrated {len(legacy)} log entries from {LOG_FILE}")
+    except Exception as e:
+        print(f"[!] Could not migrate legacy log: {e}")
+
+def log_action(action, username, result):
+    """Persistent append-only logging (O(1) per action, full history kept)"""
+    log_actions([(action, username, result)])
+
+def log_actions(actions):
+    """Log several (action, username, result) entries under one lock acquisition"""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    entries = [{'timestamp': timestamp, 'action': action, 'username': username, 'result': result}
+               for action, username, result in actions]
+    try:
+        with timed('file', 'audit_log'), audit_log_lock():
+            migrate_legacy_log()
+            append_log_entries(entries)
+        publish_event('log', entries)
     except Exception as e:
         print(f"[!] Logging error: {e}")
 
-def get_logs():
-    """Retrieve logs from file"""
+def log_entry_matches(entry, action=None, username=None, since=None, until=None):
+    if action and entry.get('action') != action:
+        return False
+    # Targets such as "alice to shared_db" match on their first word
+    if username and str(entry.get('username', '')).split(' ')[0] != username:
+        return False
+    if since and entry.get('timestamp', '') < since:
+        return False
+    if until and entry.get('timestamp', '') > until:
+        return False
+    return True
+
+def get_logs(limit=50, cursor=None, action=None, username=None, since=None, until=None):
+    """Retrieve a page of logs, newest page first.
+
+    `cursor` is the sequence number to continue before (the `next_cursor` of
+    the previous page). Returns (entries in chronological order, next_cursor).
+    """
+    page = []
     try:
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r') as f:
-                return json.load(f)
-        return []
-    except:
-        return []
+        with timed('file', 'audit_log'):
+            for first_seq, path in reversed(list_log_segments()):
+                if cursor is not None and first_seq >= cursor:
+                    continue
+                size = os.path.getsize(path)
+                offsets = [offset for _, offset in read_log_index(path)] or [0]
+                bounds = list(zip(offsets, offsets[1:] + [size]))
+                with open(path, 'rb') as f:
+                    # Walk the segment backwards one index interval at a time
+                    for start, end in reversed(bounds):
+                        f.seek(start)
+                        # The last piece has no newline: an entry still being written (or torn)
+                        chunk = f.read(end - start).split(b'\n')[:-1]
+                        for raw in reversed(chunk):
+                            try:
+                                entry = json.loads(raw)
+                            except ValueError:
+                                continue
+                            if cursor is not None and entry['seq'] >= cursor:
+                                continue
+                            if since and entry.get('timestamp', '') < since:
+                                # Entries are in time order: nothing older can match
+                                return list(reversed(page)), None
+                            if log_entry_matches(entry, action, username, since, until):
+                                page.append(entry)
+                                if len(page) >= limit:
+                                    return list(reversed(page)), entry['seq']
+    except Exception as e:
+        print(f"[!] Error reading logs: {e}")
+    return list(reversed(page)), None
 
-def get_system_users():
+def is_listed_account(p):
+    """Accounts shown in the inventory (root is listed separately)"""
+    return p.pw_uid >= 1000 and p.pw_shell not in ['/sbin/nologin', '/bin/false']
+
+def read_system_users():
     users = []
-    min_uid = 1000
-    for p in pwd.getpwall():
-        if p.pw_name == 'root' or (p.pw_uid >= min_uid and p.pw_shell not in ['/sbin/nologin', '/bin/false']):
+    with timed('file', 'passwd'):
+        entries = pwd.getpwall()
+    for p in entries:
+        if p.pw_name == 'root' or is_listed_account(p):
             users.append(p.pw_name)
     return sorted(users)
 
+# Inventory cache: snapshot of the user list, rebuilt when the app mutates users,
+# when /etc/passwd or /etc/shadow change on disk, or when DB sizes are older than the TTL
+INVENTORY_LOCK = threading.Lock()
+INVENTORY_CACHE = {
+    'stamp': None,
+    'users': None,
+    'details': None,
+    'db_sizes': None,
+    'db_sizes_at': 0,
+    'etag': None,
+    'version': 0,
+    'rows': None
+}
+# (version, rows changed or added, usernames removed) for the most recent versions
+INVENTORY_CHANGES = deque(maxlen=INVENTORY_CHANGE_HISTORY)
+
+# Clients see versions as "<epoch>-<n>". The history above is per process and the epoch is
+# new in every process (and forked worker), so a version another gunicorn worker issued is
+# answered with the full list instead of a delta against the wrong history
+def new_inventory_epoch():
+    global INVENTORY_EPOCH
+    INVENTORY_EPOCH = secrets.token_hex(4)
+
+new_inventory_epoch()
+os.register_at_fork(after_in_child=new_inventory_epoch)
+
+def inventory_version_token(n):
+    return f"{INVENTORY_EPOCH}-{n}"
+
+def inventory_version_number(token):
+    """Counter of a version this process issued, else None"""
+    epoch, _, n = str(token or '').rpartition('-')
+    return int(n) if epoch == INVENTORY_EPOCH and n.isdigit() else None
+
+def inventory_file_stamp():
+    """Change marker for the account databases (mtime and size of passwd/shadow)"""
+    stamp = []
+    for path in (PASSWD_FILE, SHADOW_FILE):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+def invalidate_inventory(db_sizes=False):
+    """Drop the cached user list after the app changed users (and the sizes after a new sample)"""
+    with INVENTORY_LOCK:
+        INVENTORY_CACHE['stamp'] = None
+        INVENTORY_CACHE['users'] = None
+        INVENTORY_CACHE['details'] = None
+        if db_sizes:
+            INVENTORY_CACHE['db_sizes'] = None
+
+def get_system_users():
+    stamp = inventory_file_stamp()
+    with INVENTORY_LOCK:
+        if INVENTORY_CACHE['users'] is not None and INVENTORY_CACHE['stamp'] == stamp:
+            return list(INVENTORY_CACHE['users'])
+    users = read_system_users()
+    with INVENTORY_LOCK:
+        INVENTORY_CACHE['stamp'] = stamp
+        INVENTORY_CACHE['users'] = users
+        INVENTORY_CACHE['details'] = None
+    return list(users)
+
 def update_ssh_config():
+    """Rewrite AllowUsers and reload sshd, only when the set of users actually changed"""
     print("[*] Updating SSH configuration...")
-    sshd_config_path = '/etc/ssh/sshd_config'
+    sshd_config_path = SSHD_CONFIG_FILE
     
     allowed_users = get_system_users()
     allow_users_line = "AllowUsers " + " ".join(allowed_users)
 
     try:
-        with open(sshd_config_path, 'r') as f:
-            lines = f.readlines()
+        with SSH_UPDATE_LOCK:
+            with timed('file', 'sshd_config'), open(sshd_config_path, 'r') as f:
+                lines = f.readlines()
 
-        new_lines = []
-        found = False
-        for line in lines:
-            if line.strip().startswith("AllowUsers"):
-                new_lines.append(allow_users_line + '\n')
-                found = True
-            else:
-                new_lines.append(line)
-        
-        if not found:
-            new_lines.append('\n' + allow_users_line + '\n')
+            current = [line.split()[1:] for line in lines if line.strip().startswith("AllowUsers")]
+            if len(current) == 1 and set(current[0]) == set(allowed_users):
+                print("[*] SSH config unchanged, skipping reload.")
+                return {"status": "success", "message": "SSH permissions unchanged.", "changed": False}
+
+            new_lines = []
+            found = False
+            for line in lines:
+                if line.strip().startswith("AllowUsers"):
+                    # Keep a single AllowUsers line
+                    if not found:
+                        new_lines.append(allow_users_line + '\n')
+                    found = True
+                else:
+                    new_lines.append(line)
             
-        temp_path = sshd_config_path + ".tmp"
-        with open(temp_path, 'w') as f:
-            f.writelines(new_lines)
-        
-        shutil.move(temp_path, sshd_config_path)
-        
-        subprocess.run(['systemctl', 'restart', 'sshd'], check=True)
+            if not found:
+                new_lines.append('\n' + allow_users_line + '\n')
+                
+            temp_path = sshd_config_path + ".tmp"
+            with timed('file', 'sshd_config'):
+                with open(temp_path, 'w') as f:
+                    f.writelines(new_lines)
+                shutil.move(temp_path, sshd_config_path)
+            
+            # A reload re-reads AllowUsers without dropping established sessions
+            try:
+                run_command(['systemctl', 'reload', 'sshd'], check=True, capture_output=True)
+            except subprocess.CalledProcessError:
+                run_command(['systemctl', 'restart', 'sshd'], check=True)
         print(f"[+] SSH config updated. Allowed users: {', '.join(allowed_users)}")
-        return {"status": "success", "message": "SSH permissions updated."}
+        return {"status": "success", "message": "SSH permissions updated.", "changed": True}
 
     except Exception as e:
         print(f"[!] Error updating SSH config: {e}")
         return {"status": "error", "message": f"Failed to update SSH config: {e}"}
 
-def get_database_users():
-    print("[*] Fetching database users...")
-    try:
-        sql_command = "SELECT user FROM mysql.user WHERE host = 'localhost' AND user NOT IN ('root', 'mysql', 'mariadb.sys');"
-        result = subprocess.run(
-            ['mysql', '-N', '-e', sql_command], check=True, capture_output=True, text=True
-        )
-        users = result.stdout.strip().split('\n')
-        return sorted([user for user in users if user])
-    except subprocess.CalledProcessError as e:
-        print(f"[!] Error fetching database users: {e.stderr}")
-        return []
+# Coalesced SSH updates: changes arriving within SSH_UPDATE_WINDOW share one rewrite/reload
+SSH_UPDATE_LOCK = threading.Lock()
+SSH_UPDATE_STATE_LOCK = threading.Lock()
+SSH_UPDATE_STATE = {
+    'timer': None,
+    'pending': 0,
+    'requested': 0,
+    'merged': 0,
+    'applied': 0,
+    'unchanged': 0,
+    'failed': 0,
+    'last_result': None,
+    'last_run_at': None
+}
 
-def get_db_size(db_name):
-    try:
-        sql = f"SELECT ROUND(SUM(data_length + index_length) / 1024 / 1024, 2) FROM information_schema.TABLES WHERE table_schema = '{db_name}';"
-        result = subprocess.run(['mysql', '-N', '-e', sql], capture_output=True, text=True, check=True)
-        size = result.stdout.strip()
-        return f"{size} MB" if size and size != 'NULL' else "0 MB"
-    except:
-        return "0 MB"
+def schedule_ssh_update():
+    """Request an AllowUsers update; returns immediately"""
+    with SSH_UPDATE_STATE_LOCK:
+        SSH_UPDATE_STATE['requested'] += 1
+        SSH_UPDATE_STATE['pending'] += 1
+        if SSH_UPDATE_STATE['timer'] is None:
+            timer = threading.Timer(SSH_UPDATE_WINDOW, flush_ssh_updates)
+            timer.daemon = True
+            SSH_UPDATE_STATE['timer'] = timer
+            timer.start()
+    return {"status": "success", "message": "SSH permissions update scheduled."}
+
+def flush_ssh_updates():
+    """Apply all pending update requests with a single update_ssh_config() run"""
+    with SSH_UPDATE_STATE_LOCK:
+        timer = SSH_UPDATE_STATE['timer']
+        SSH_UPDATE_STATE['timer'] = None
+        pending = SSH_UPDATE_STATE['pending']
+        SSH_UPDATE_STATE['pending'] = 0
+    if timer is not None:
+        timer.cancel()
+    if pending == 0:
+        return None
+
+    result = update_ssh_config()
+    with SSH_UPDATE_STATE_LOCK:
+        SSH_UPDATE_STATE['merged'] += pending - 1
+        if result['status'] != 'success':
+            SSH_UPDATE_STATE['failed'] += 1
+        elif result.get('changed'):
+            SSH_UPDATE_STATE['applied'] += 1
+        else:
+            SSH_UPDATE_STATE['unchanged'] += 1
+        SSH_UPDATE_STATE['last_result'] = dict(result, merged_requests=pending)
+        SSH_UPDATE_STATE['last_run_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return result
+
+# Don't lose a scheduled update when the app stops inside the window
+atexit.register(flush_ssh_updates)
+
+def measure_db_sizes(db_names):
+    """Bytes used by each database, from one grouped information_schema query"""
+    sizes = {db: 0 for db in db_names}
+    if not sizes:
+        return sizes
+    placeholders = ', '.join(['%s'] * len(sizes))
+    sql = f"SELECT table_schema, SUM(data_length + index_length) FROM information_schema.TABLES WHERE table_schema IN ({placeholders}) GROUP BY table_schema"
+    for schema, size in db_query(sql, tuple(sizes)):
+        sizes[schema] = int(size or 0)
+    return sizes
 
-def is_user_locked(username):
+def get_locked_users():
+    """Locked accounts from one pass over the shadow database (same rule as passwd -S)"""
+    locked = set()
     try:
-        result = subprocess.run(['passwd', '-S', username], capture_output=True, text=True)
-        return 'L' in result.stdout.split()[1] if result.stdout else False
-    except:
-        return False
+        with timed('file', 'shadow'), open(SHADOW_FILE, 'r') as f:
+            for line in f:
+                fields = line.rstrip('\n').split(':')
+                if len(fields) > 1 and fields[1].startswith('!'):
+                    locked.add(fields[0])
+    except Exception as e:
+        print(f"[!] Error reading shadow database: {e}")
+    return locked
 
-def get_user_details():
-    sys_users = get_system_users()
+def build_user_details(sys_users, db_sizes, locked_users):
     users_info = []
     for user in sys_users:
         if user != 'root':
             users_info.append({
                 'username': user,
                 'password': '****',  # Never expose passwords
-                'db_size': get_db_size(user),
-                'locked': is_user_locked(user)
+                'db_size': db_sizes.get(user, "0 MB"),
+                'locked': user in locked_users
             })
     return users_info
 
+def get_inventory_snapshot():
+    """Cached (user_details, etag, version); rebuilt only when something changed"""
+    sys_users = get_system_users()
+    now = time.monotonic()
+    with INVENTORY_LOCK:
+        sizes_fresh = INVENTORY_CACHE['db_sizes'] is not None and now - INVENTORY_CACHE['db_sizes_at'] < INVENTORY_DB_SIZE_TTL
+        if INVENTORY_CACHE['details'] is not None and sizes_fresh:
+            return INVENTORY_CACHE['details'], INVENTORY_CACHE['etag'], inventory_version_token(INVENTORY_CACHE['version'])
+        db_sizes = INVENTORY_CACHE['db_sizes'] if sizes_fresh else None
+
+    # DB sizes come from the background sampler; lock states from one shadow read
+    if db_sizes is None:
+        db_sizes = get_sampled_db_sizes()
+    details = build_user_details(sys_users, db_sizes, get_locked_users())
+    etag = hashlib.sha1(json.dumps(details, sort_keys=True).encode('utf-8')).hexdigest()
+    rows = {user['username']: user for user in details}
+
+    change = None
+    with INVENTORY_LOCK:
+        if not sizes_fresh:
+            INVENTORY_CACHE['db_sizes'] = db_sizes
+            INVENTORY_CACHE['db_sizes_at'] = now
+        if etag != INVENTORY_CACHE['etag']:
+            INVENTORY_CACHE['version'] += 1
+            INVENTORY_CACHE['etag'] = etag
+            previous = INVENTORY_CACHE['rows'] or {}
+            changed = [row for name, row in rows.items() if previous.get(name) != row]
+            removed = sorted(name for name in previous if name not in rows)
+            INVENTORY_CHANGES.append((INVENTORY_CACHE['version'], changed, removed))
+            if INVENTORY_CACHE['rows'] is not None:
+                change = {"version": inventory_version_token(INVENTORY_CACHE['version']),
+                          "since": inventory_version_token(INVENTORY_CACHE['version'] - 1),
+                          "full": False, "changed": changed, "removed": removed}
+            INVENTORY_CACHE['rows'] = rows
+        # Only cache if the user list was not invalidated while we were building
+        if INVENTORY_CACHE['users'] is not None:
+            INVENTORY_CACHE['details'] = details
+        version = inventory_version_token(INVENTORY_CACHE['version'])
+    if change:
+        publish_event('inventory', change, event_id=change['version'])
+    return details, etag, version
+
+def inventory_delta(since):
+    """Rows changed and usernames removed after inventory version `since`.
+
+    Falls back to the full list ("full": true) when `since` is missing, older than the
+    retained history or was issued by another process.
+    """
+    details, _, version = get_inventory_snapshot()
+    current = inventory_version_number(version)
+    base = inventory_version_number(since)
+    changes = None
+    if base is not None and base <= current:
+        with INVENTORY_LOCK:
+            changes = [c for c in INVENTORY_CHANGES if base < c[0] <= current]
+        if base < current and (not changes or changes[0][0] != base + 1):
+            changes = None
+    if changes is None:
+        return {"version": version, "since": since if base is not None else None, "full": True,
+                "changed": list(details), "removed": []}
+
+    changed, removed = {}, set()
+    for _, rows, gone in changes:
+        for name in gone:
+            changed.pop(name, None)
+            removed.add(name)
+        for row in rows:
+            changed[row['username']] = row
+            removed.discard(row['username'])
+    return {"version": version, "since": since, "full": False,
+            "changed": [changed[name] for name in sorted(changed)], "removed": sorted(removed)}
+
+def request_inventory_since():
+    """Inventory version the caller already has: ?since=, else the current one"""
+    since = request.args.get('since')
+    return since if since is not None else get_inventory_snapshot()[2]
+
+# Event stream: every /events client has a bounded queue; a client that falls behind is
+# marked and gets one full "resync" instead of the events it missed
+EVENT_LOCK = threading.Lock()
+EVENT_SUBSCRIBERS = []
+
+def subscribe_events():
+    with EVENT_LOCK:
+        if len(EVENT_SUBSCRIBERS) >= EVENT_MAX_CLIENTS:
+            return None
+        subscriber = {'queue': queue.Queue(maxsize=EVENT_QUEUE_SIZE), 'overflow': False}
+        EVENT_SUBSCRIBERS.append(subscriber)
+        return subscriber
+
+def unsubscribe_events(subscriber):
+    with EVENT_LOCK:
+        if subscriber in EVENT_SUBSCRIBERS:
+            EVENT_SUBSCRIBERS.remove(subscriber)
+
+def publish_event(kind, data, event_id=None):
+    with EVENT_LOCK:
+        subscribers = list(EVENT_SUBSCRIBERS)
+    for subscriber in subscribers:
+        try:
+            subscriber['queue'].put_nowait((kind, data, event_id))
+        except queue.Full:
+            subscriber['overflow'] = True
+
+def format_event(kind, data, event_id=None):
+    lines = [f"event: {kind}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return '\n'.join(lines) + '\n\n'
+
+# Database size sampler. The history file is delta-encoded JSONL: each line holds the
+# sample time and only the sizes that changed ("s") or databases that disappeared ("d");
+# every DB_SIZE_KEYFRAME_EVERY-th line is a full keyframe ("k": 1).
+DB_SIZE_LOCK = threading.Lock()
+DB_SIZE_STATE = {
+    'latest': {},
+    'sampled_at': None,
+    'lines': 0,
+    'file_stamp': None,
+    'leader_lock': None,
+    'thread': None
+}
+
+def format_db_size(size_bytes):
+    return f"{size_bytes / 1024 / 1024:.2f} MB"
+
+def get_sampled_db_sizes():
+    """{db: 'N MB'} from the latest sample (no database query)"""
+    if not DB_SIZE_STATE['leader_lock']:
+        reload_db_size_history()
+    with DB_SIZE_LOCK:
+        return {db: format_db_size(size) for db, size in DB_SIZE_STATE['latest'].items() if size}
+
+def iter_db_size_history():
+    """Yield (timestamp, full sizes dict) for every stored sample, oldest first"""
+    if not os.path.exists(DB_SIZE_HISTORY_FILE):
+        return
+    state = {}
+    with open(DB_SIZE_HISTORY_FILE, 'r') as f:
+        for line in f:
+            try:
+                sample = json.loads(line)
+            except ValueError:
+                continue  # torn last line
+            if sample.get('k'):
+                state = {}
+            state.update(sample.get('s', {}))
+            for db in sample.get('d', []):
+                state.pop(db, None)
+            yield sample['t'], state
+
+def reload_db_size_history():
+    """Pick up samples written by the sampling process (when another worker holds the lead)"""
+    try:
+        st = os.stat(DB_SIZE_HISTORY_FILE)
+    except OSError:
+        return
+    stamp = (st.st_mtime_ns, st.st_size)
+    if stamp == DB_SIZE_STATE['file_stamp']:
+        return
+    latest, sampled_at, lines = {}, None, 0
+    with timed('file', 'db_size_history'):
+        for sampled_at, state in iter_db_size_history():
+            latest = state
+            lines += 1
+    with DB_SIZE_LOCK:
+        DB_SIZE_STATE.update(latest=dict(latest), sampled_at=sampled_at, lines=lines, file_stamp=stamp)
+
+def compact_db_size_history():
+    """Keep only the newest DB_SIZE_HISTORY_SAMPLES samples (atomic rewrite)"""
+    with timed('file', 'db_size_history'):
+        samples = list((t, dict(state)) for t, state in iter_db_size_history())[-DB_SIZE_HISTORY_SAMPLES:]
+        temp_path = DB_SIZE_HISTORY_FILE + '.tmp'
+        previous = None
+        with open(temp_path, 'w') as f:
+            for i, (t, state) in enumerate(samples):
+                f.write(encode_db_size_sample(t, previous, state, keyframe=(i % DB_SIZE_KEYFRAME_EVERY == 0)) + '\n')
+                previous = state
+        os.replace(temp_path, DB_SIZE_HISTORY_FILE)
+    return len(samples)
+
+def encode_db_size_sample(t, previous, state, keyframe):
+    if keyframe or previous is None:
+        return json.dumps({'t': t, 'k': 1, 's': state}, separators=(',', ':'))
+    changed = {db: size for db, size in state.items() if previous.get(db) != size}
+    removed = [db for db in previous if db not in state]
+    sample = {'t': t, 's': changed}
+    if removed:
+        sample['d'] = removed
+    return json.dumps(sample, separators=(',', ':'))
+
+def sample_db_sizes():
+    """Measure every user and shared database once and append the sample"""
+    db_names = [u for u in get_system_users() if u != 'root'] + list_shared_dbs()
+    sizes = measure_db_sizes(sorted(set(db_names)))
+    t = int(time.time())
+    with DB_SIZE_LOCK:
+        previous = DB_SIZE_STATE['latest'] if DB_SIZE_STATE['sampled_at'] is not None else None
+        keyframe = DB_SIZE_STATE['lines'] % DB_SIZE_KEYFRAME_EVERY == 0
+        line = encode_db_size_sample(t, previous, sizes, keyframe)
+        os.makedirs(os.path.dirname(DB_SIZE_HISTORY_FILE), exist_ok=True)
+        with timed('file', 'db_size_history'), open(DB_SIZE_HISTORY_FILE, 'a') as f:
+            f.write(line + '\n')
+        DB_SIZE_STATE.update(latest=sizes, sampled_at=t, lines=DB_SIZE_STATE['lines'] + 1)
+        if DB_SIZE_STATE['lines'] >= 2 * DB_SIZE_HISTORY_SAMPLES:
+            DB_SIZE_STATE['lines'] = compact_db_size_history()
+    invalidate_inventory(db_sizes=True)
+    return sizes
+
+def db_size_sampler_loop():
+    while True:
+        try:
+            if not DB_SIZE_STATE['leader_lock']:
+                # Only one worker process samples; the others read its history file
+                lock_file = open(DB_SIZE_HISTORY_FILE + '.lock', 'w')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    DB_SIZE_STATE['leader_lock'] = lock_file
+                    DB_SIZE_STATE['file_stamp'] = None
+                    reload_db_size_history()
+                except BlockingIOError:
+                    lock_file.close()
+            if DB_SIZE_STATE['leader_lock']:
+                sample_db_sizes()
+            else:
+                reload_db_size_history()
+        except Exception as e:
+            print(f"[!] DB size sampling failed: {e}")
+        time.sleep(DB_SIZE_SAMPLE_INTERVAL)
+
+def start_db_size_sampler():
+    with DB_SIZE_LOCK:
+        if DB_SIZE_STATE['thread'] is not None:
+            return
+        os.makedirs(os.path.dirname(DB_SIZE_HISTORY_FILE), exist_ok=True)
+        thread = threading.Thread(target=db_size_sampler_loop, name='user-manager-db-sizes', daemon=True)
+        DB_SIZE_STATE['thread'] = thread
+    thread.start()
+
+def db_growth(window_seconds, top):
+    """Per-database growth over the window, from the stored samples"""
+    cutoff = time.time() - window_seconds
+    start, start_t, latest, latest_t, samples = None, None, {}, None, 0
+    for t, state in iter_db_size_history():
+        if t >= cutoff:
+            samples += 1
+            if start is None:
+                start, start_t = dict(state), t
+            latest, latest_t = state, t
+    databases = []
+    for db, size in sorted(latest.items()):
+        initial = (start or {}).get(db, 0)
+        growth = size - initial
+        span_days = (latest_t - start_t) / 86400 if latest_t and start_t and latest_t > start_t else None
+        databases.append({
+            'database': db,
+            'size_bytes': size,
+            'size': format_db_size(size),
+            'start_bytes': initial,
+            'growth_bytes': growth,
+            'growth_percent': round(100.0 * growth / initial, 1) if initial else None,
+            'growth_bytes_per_day': round(growth / span_days) if span_days else None
+        })
+    growers = sorted((d for d in databases if d['growth_bytes'] > 0), key=lambda d: d['growth_bytes'], reverse=True)
+    return {
+        'window_seconds': window_seconds,
+        'samples': samples,
+        'from': start_t,
+        'to': latest_t,
+        'databases': databases,
+        'top_growers': growers[:top]
+    }
+
+def conditional_response(etag, build):
+    """304 when the client already has this ETag, otherwise build the response"""
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    # Always revalidate, the inventory can change at any time
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 def create_system_user(username, password):
     # Security: Validate input
     if not is_safe_input(username):
         return {"status": "error", "message": "Invalid username format. Only alphanumeric and underscore allowed."}
     
     try:
-        subprocess.run(['useradd', '-m', '-s', '/bin/bash', username], check=True, capture_output=True)
-        command = f"echo '{username}:{password}' | chpasswd"
-        subprocess.run(command, shell=True, check=True, capture_output=True)
+        with PASSWD_LOCK:
+            run_command(['useradd', '-m', '-s', '/bin/bash', username], check=True, capture_output=True)
+        with PASSWD_LOCK:
+            run_command(['chpasswd'], input=f"{username}:{password}\n".encode(), check=True, capture_output=True)
         # Security: Never store passwords in plain text
         return {"status": "success", "message": f"SSH user '{username}' created."}
     except subprocess.CalledProcessError as e:
@@ -215,46 +1392,779 @@ def create_database_user(username, password):
         return {"status": "error", "message": "Invalid username format"}
     
     db_name = username
-    sql_commands = f"""
-    CREATE DATABASE IF NOT EXISTS `{db_name}`;
-    CREATE USER IF NOT EXISTS '{username}'@'localhost' IDENTIFIED BY '{password}';
-    GRANT ALL PRIVILEGES ON `{db_name}`.* TO '{username}'@'localhost';
-    FLUSH PRIVILEGES;
-    """
+    sql_commands = create_user_statements(username, password) + ["FLUSH PRIVILEGES"]
     try:
-        subprocess.run(['mysql', '-e', sql_commands], check=True, capture_output=True, text=True)
+        db_execute_script(sql_commands)
         return {"status": "success", "message": f"DB user '{username}' created and restricted to database '{db_name}'."}
-    except subprocess.CalledProcessError as e:
-        error_message = e.stderr.decode().strip()
+    except Exception as e:
+        error_message = db_error_message(e)
         log_action('create_db_user', username, f'failed: {error_message}')
         return {"status": "error", "message": f"Failed to create DB user: {error_message}"}
 
+def create_user_statements(username, password):
+    """SQL that creates a user's database and a DB account restricted to it"""
+    return [
+        f"CREATE DATABASE IF NOT EXISTS `{username}`",
+        ("CREATE USER IF NOT EXISTS %s@'localhost' IDENTIFIED BY %s", (username, password)),
+        (f"GRANT ALL PRIVILEGES ON `{username}`.* TO %s@'localhost'", (username,))
+    ]
+
+def validate_roster(roster):
+    """Validate a whole roster of (username, password) pairs up front.
+
+    Returns one error result (or None when the entry is valid) per entry.
+    """
+    errors = []
+    seen = set()
+    for username, password in roster:
+        # Security: Validate username
+        if not is_safe_input(username):
+            errors.append({"status": "error", "message": f"Invalid username format: {username}"})
+        # newusers/chpasswd read colon-separated lines
+        elif not password or not isinstance(password, str) or ':' in password or '\n' in password:
+            errors.append({"status": "error", "message": f"Invalid password for: {username}"})
+        elif username in seen:
+            errors.append({"status": "error", "message": f"Duplicate username: {username}"})
+        else:
+            errors.append(None)
+        seen.add(username)
+    return errors
+
+def run_per_user(items, step, on_error, progress=None, width=None):
+    """Run `step(item)` for every item on a bounded thread pool.
+
+    Results come back in input order. An exception raised for one item is
+    turned into that item's result by `on_error(item, exc)` and does not
+    affect the others. `progress` is called with each result as it finishes.
+    """
+    width = max(1, min(width or PROVISION_WORKERS, len(items)))
+
+    def guarded(item):
+        try:
+            return step(item)
+        except Exception as e:
+            return on_error(item, e)
+
+    if width == 1:
+        results = []
+        for item in items:
+            results.append(guarded(item))
+            if progress:
+                progress(results[-1])
+        return results
+
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=width, thread_name_prefix='user-manager-provision') as pool:
+        futures = {pool.submit(guarded, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if progress:
+                progress(results[futures[future]])
+    return results
+
+def provision_one_user(entry):
+    """Create one user's system account and database; returns (results, created)"""
+    username, password = entry
+    # Security: Validate username
+    if not is_safe_input(username):
+        return [{"status": "error", "message": f"Invalid username format: {username}"}], False
+
+    if not password or not isinstance(password, str):
+        return [{"status": "error", "message": f"Invalid password for: {username}"}], False
+
+    # Create user
+    result_sys = create_system_user(username, password)
+    if result_sys.get('status') == 'success' or result_sys.get('status') == 'warning':
+        result_db = create_database_user(username, password)
+        log_action('create_user', username, 'success')
+        return [result_sys, result_db], True
+    return [result_sys], False
+
+def provision_users(roster, progress=None):
+    """Create users one pipeline per user (useradd + chpasswd + SQL), several users at a time.
+
+    Returns (results, valid_count, invalid_count). `progress` is called with
+    each user's results as soon as that user is done.
+    """
+    outcomes = run_per_user(
+        roster,
+        provision_one_user,
+        lambda entry, e: ([{"status": "error", "message": f"Failed to create user {entry[0]}: {e}"}], False),
+        progress=(lambda outcome: progress(outcome[0])) if progress else None
+    )
+
+    results = []
+    valid_count = 0
+    invalid_count = 0
+    for user_results, created in outcomes:
+        results.extend(user_results)
+        if created:
+            valid_count += 1
+        else:
+            invalid_count += 1
+
+    return results, valid_count, invalid_count
+
+def create_system_users_bulk(entries):
+    """Create new system users with one newusers stdin stream.
+
+    Returns a result per username. If newusers rejects the batch it writes
+    nothing, so fall back to per-user creation to isolate the failing entries.
+    """
+    if not entries:
+        return {}
+    lines = ''.join(f"{username}:{password}::::/home/{username}:/bin/bash\n" for username, password in entries)
+    try:
+        with PASSWD_LOCK:
+            run_command(['newusers'], input=lines, check=True, capture_output=True, text=True)
+        return {username: {"status": "success", "message": f"SSH user '{username}' created."} for username, _ in entries}
+    except (subprocess.CalledProcessError, OSError) as e:
+        error_detail = e.stderr.strip() if getattr(e, 'stderr', None) else str(e)
+        print(f"[!] Bulk user creation failed, falling back to per-user creation: {error_detail}")
+        return {username: create_system_user(username, password) for username, password in entries}
+
+def create_database_users_bulk(entries):
+    """Create databases and DB users for all entries as one SQL batch with a single FLUSH"""
+    try:
+        errors = db_execute_groups(
+            [create_user_statements(username, password) for username, password in entries],
+            final=["FLUSH PRIVILEGES"]
+        )
+    except Exception as e:
+        errors = [e] * len(entries)
+    results = {}
+    for (username, _), error in zip(entries, errors):
+        if error is None:
+            results[username] = {"status": "success", "message": f"DB user '{username}' created and restricted to database '{username}'."}
+        else:
+            error_message = db_error_message(error)
+            log_action('create_db_user', username, f'failed: {error_message}')
+            results[username] = {"status": "error", "message": f"Failed to create DB user: {error_message}"}
+    return results
+
+def provision_users_bulk(roster, progress=None):
+    """Create a whole roster with a fixed number of commands.
+
+    Same results as provision_users(), but the roster is validated up front,
+    all new system accounts are created by one newusers call and all database
+    objects by one SQL batch.
+    """
+    errors = validate_roster(roster)
+    valid = [entry for entry, error in zip(roster, errors) if error is None]
+
+    existing = {p.pw_name for p in pwd.getpwall()}
+    sys_results = {
+        username: {"status": "warning", "message": f"SSH user '{username}' already exists."}
+        for username, _ in valid if username in existing
+    }
+    sys_results.update(create_system_users_bulk([entry for entry in valid if entry[0] not in existing]))
+
+    db_entries = [entry for entry in valid if sys_results[entry[0]].get('status') in ('success', 'warning')]
+    db_results = create_database_users_bulk(db_entries) if db_entries else {}
+
+    results = []
+    valid_count = 0
+    invalid_count = 0
+    for (username, _), error in zip(roster, errors):
+        if error is not None:
+            user_results = [error]
+            invalid_count += 1
+        else:
+            user_results = [sys_results[username]]
+            if username in db_results:
+                user_results.append(db_results[username])
+                log_action('create_user', username, 'success')
+                valid_count += 1
+            else:
+                invalid_count += 1
+        results.extend(user_results)
+        if progress:
+            progress(user_results)
+
+    return results, valid_count, invalid_count
+
+# Streaming roster ingestion: JSONL or CSV is parsed line by line and provisioned in chunks
+# of INGEST_CHUNK_SIZE, so memory use does not grow with the file and work starts early
+def iter_roster_lines(stream, fmt):
+    """Yield (line number, username, password, error) for every entry of a JSONL/CSV stream.
+
+    JSONL lines are {"username": ..., "password": ...} or {"username": "password"};
+    CSV rows are `username,password`, with an optional header row.
+    """
+    position = {'line': 0}
+    decode_errors = []
+
+    def decoded_lines():
+        for raw in stream:
+            position['line'] += 1
+            try:
+                yield raw.decode('utf-8-sig' if position['line'] == 1 else 'utf-8')
+            except UnicodeDecodeError:
+                decode_errors.append(position['line'])
+                yield '\n'
+
+    def entry_error(line, message):
+        return (line, None, None, {"status": "error", "line": line, "message": message})
+
+    if fmt == 'csv':
+        rows = csv.reader(decoded_lines())
+        while True:
+            # A quoted field can span lines: report the line the record starts on
+            line = rows.line_num + 1
+            row = next(rows, None)
+            if row is None:
+                break
+            while decode_errors:
+                yield entry_error(decode_errors.pop(0), "Invalid encoding, expected UTF-8")
+            if not row or not any(field.strip() for field in row):
+                continue
+            if line == 1 and [field.strip().lower() for field in row[:2]] == ['username', 'password']:
+                continue
+            if len(row) != 2:
+                yield entry_error(line, f"Expected 2 columns (username,password), got {len(row)}")
+                continue
+            yield (line, row[0].strip(), row[1], None)
+    else:
+        for text in decoded_lines():
+            line = position['line']
+            if decode_errors:
+                yield entry_error(decode_errors.pop(0), "Invalid encoding, expected UTF-8")
+                continue
+            if not text.strip():
+                continue
+            try:
+                item = json.loads(text)
+            except json.JSONDecodeError as e:
+                yield entry_error(line, f"Invalid JSON: {e.msg}")
+                continue
+            if isinstance(item, dict) and 'username' in item:
+                username, password = item.get('username'), item.get('password')
+            elif isinstance(item, dict) and len(item) == 1:
+                (username, password), = item.items()
+            else:
+                yield entry_error(line, "Expected {\"username\": ..., \"password\": ...}")
+                continue
+            if not isinstance(username, str):
+                yield entry_error(line, "Username must be a string")
+                continue
+            yield (line, username, password, None)
+    while decode_errors:
+        yield entry_error(decode_errors.pop(0), "Invalid encoding, expected UTF-8")
+
+def ingest_roster(stream, fmt, progress=None):
+    """Validate and provision a streamed roster chunk by chunk.
+
+    Returns (problems, created, skipped): only errors and warnings are kept, each with
+    the line it came from, so the result stays small for very large files.
+    """
+    problems = []
+    counts = {'created': 0, 'skipped': 0}
+    seen = set()
+
+    def report(user_results):
+        problems.extend(user_results)
+        if progress:
+            progress(user_results)
+
+    def provision_chunk(chunk):
+        lines = iter([line for line, _ in chunk])
+
+        def chunk_progress(user_results):
+            line = next(lines)
+            report([dict(r, line=line) for r in user_results if r.get('status') != 'success'])
+
+        _, created, skipped = provision_users_bulk([entry for _, entry in chunk], chunk_progress)
+        counts['created'] += created
+        counts['skipped'] += skipped
+        # New users can log in and show up on dashboards while the rest is still being read
+        schedule_ssh_update()
+        invalidate_inventory()
+
+    chunk = []
+    for line, username, password, error in iter_roster_lines(stream, fmt):
+        # Security: Validate input before anything reaches useradd or SQL
+        if error is None:
+            error = validate_roster([(username, password)])[0]
+        if error is None and username in seen:
+            error = {"status": "error", "message": f"Duplicate username: {username}"}
+        if error is not None:
+            counts['skipped'] += 1
+            report([dict(error, line=line)])
+            continue
+        seen.add(username)
+        chunk.append((line, (username, password)))
+        if len(chunk) >= INGEST_CHUNK_SIZE:
+            provision_chunk(chunk)
+            chunk = []
+    if chunk:
+        provision_chunk(chunk)
+    return problems, counts['created'], counts['skipped']
+
+def spool_upload(stream):
+    """Copy an upload to a private temp file; returns (path, sha256, line count)"""
+    digest = hashlib.sha256()
+    lines = 0
+    # Security: The roster holds passwords; mkstemp creates the file mode 0600
+    fd, path = tempfile.mkstemp(prefix='user_manager_roster_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                lines += block.count(b'\n')
+                f.write(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest(), lines + 1
+
+# Reconciliation: compare a roster with the current state read in bulk (passwd, shadow and
+# three queries) and apply only the differences
+def native_password_hash(password):
+    """mysql_native_password hash as stored in mysql.user"""
+    return '*' + hashlib.sha1(hashlib.sha1(password.encode('utf-8')).digest()).hexdigest().upper()
+
+# SHA-512 crypt ($6$, the /etc/shadow default) in pure Python, since the crypt module is
+# deprecated; output is identical to glibc's crypt(3)
+CRYPT_ALPHABET = './0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+SHA512_CRYPT_ORDER = [(0, 21, 42), (22, 43, 1), (44, 2, 23), (3, 24, 45), (25, 46, 4), (47, 5, 26), (6, 27, 48),
+                      (28, 49, 7), (50, 8, 29), (9, 30, 51), (31, 52, 10), (53, 11, 32), (12, 33, 54), (34, 55, 13),
+                      (56, 14, 35), (15, 36, 57), (37, 58, 16), (59, 17, 38), (18, 39, 60), (40, 61, 19), (62, 20, 41)]
+SHA512_CRYPT_DEFAULT_ROUNDS = 5000
+
+def _repeat_bytes(block, length):
+    return (block * (length // len(block) + 1))[:length]
+
+def sha512_crypt(password, salt=None, rounds=SHA512_CRYPT_DEFAULT_ROUNDS):
+    """Hash a password the way `chpasswd -c SHA512` does; a random 16-character salt by default"""
+    if salt is None:
+        salt = ''.join(secrets.choice(CRYPT_ALPHABET) for _ in range(16))
+    p = password.encode('utf-8')
+    s = salt.encode('utf-8')[:16]
+    b = hashlib.sha512(p + s + p).digest()
+    a = hashlib.sha512(p + s + _repeat_bytes(b, len(p)))
+    i = len(p)
+    while i:
+        a.update(b if i & 1 else p)
+        i >>= 1
+    c = a.digest()
+    dp = _repeat_bytes(hashlib.sha512(p * len(p)).digest(), len(p))
+    ds = _repeat_bytes(hashlib.sha512(s * (16 + c[0])).digest(), len(s))
+    for r in range(rounds):
+        h = hashlib.sha512(dp if r & 1 else c)
+        if r % 3:
+            h.update(ds)
+        if r % 7:
+            h.update(dp)
+        h.update(c if r & 1 else dp)
+        c = h.digest()
+    out = []
+    for b2, b1, b0 in SHA512_CRYPT_ORDER + [(None, None, 63)]:
+        w = ((c[b2] << 16) | (c[b1] << 8) if b2 is not None else 0) | c[b0]
+        for _ in range(4 if b2 is not None else 2):
+            out.append(CRYPT_ALPHABET[w & 0x3f])
+            w >>= 6
+    prefix = '$6$' + (f'rounds={rounds}$' if rounds != SHA512_CRYPT_DEFAULT_ROUNDS else '')
+    return prefix + s.decode('utf-8') + '$' + ''.join(out)
+
+def sha512_crypt_matches(password, stored):
+    """Check a password against a $6$ hash; None for other hash schemes"""
+    fields = stored.split('$')
+    if len(fields) < 4 or fields[1] != '6':
+        return None
+    rounds = SHA512_CRYPT_DEFAULT_ROUNDS
+    if fields[2].startswith('rounds='):
+        rounds = min(max(int(fields[2][len('rounds='):]), 1000), 999999999)
+        fields = fields[:2] + fields[3:]
+    return secrets.compare_digest(sha512_crypt(password, fields[2], rounds), stored)
+
+# A SHA-512 crypt check costs several ms; remember outcomes by a digest of (hash, password)
+# so re-syncing an unchanged roster does not redo them
+PASSWORD_CHECK_CACHE = {}
+PASSWORD_CHECK_CACHE_MAX = 100000
+
+def shadow_password_matches(password, shadow_hash):
+    """True/False when the shadow hash can be checked, None when it cannot"""
+    shadow_hash = shadow_hash.lstrip('!')
+    key = hashlib.sha256(f"{shadow_hash}\0{password}".encode('utf-8')).digest()
+    matches = PASSWORD_CHECK_CACHE.get(key)
+    if matches is None:
+        matches = sha512_crypt_matches(password, shadow_hash)
+        if matches is None:
+            return None
+        if len(PASSWORD_CHECK_CACHE) >= PASSWORD_CHECK_CACHE_MAX:
+            PASSWORD_CHECK_CACHE.clear()
+        PASSWORD_CHECK_CACHE[key] = matches
+    return matches
+
+NOBODY_UID = 65534
+
+def is_login_account(p):
+    """Regular login account: UID >= 1000, never nobody, with a shell other than nologin/false"""
+    return (p.pw_name != 'root' and p.pw_uid >= 1000 and p.pw_uid != NOBODY_UID
+            and os.path.basename(p.pw_shell or '') not in ('nologin', 'false'))
+
+def read_current_state():
+    """Accounts, shadow hashes, DB accounts, databases and own-database grants"""
+    with timed('file', 'passwd'):
+        logins = {p.pw_name for p in pwd.getpwall() if is_login_account(p)}
+    shadow = {}
+    with timed('file', 'shadow'), open(SHADOW_FILE, 'r') as f:
+        for line in f:
+            fields = line.rstrip('\n').split(':')
+            if len(fields) > 1:
+                shadow[fields[0]] = fields[1]
+    db_users = {user: (plugin, auth) for user, plugin, auth in db_query(
+        "SELECT User, plugin, authentication_string FROM mysql.user WHERE Host = 'localhost'")}
+    databases = {row[0] for row in db_query("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA")}
+    own_grants = {row[0] for row in db_query("SELECT User FROM mysql.db WHERE Host = 'localhost' AND Db = User")}
+    # Accounts this app manages have their own DB account or database; only those may be removed
+    managed = {u for u in logins if u in db_users or u in databases}
+    return {'users': logins, 'managed': managed, 'shadow': shadow, 'db_users': db_users,
+            'databases': databases, 'grants': own_grants}
+
+def plan_reconcile(roster, state, remove=False, passwords=False):
+    """Plan: users to add, per-user changes to make, and (with remove) users to delete.
+
+    Password drift is detected from the stored hashes where possible; with
+    `passwords` every existing user's passwords are set regardless.
+    """
+    add, modify, unchanged = [], {}, 0
+    for username, password in roster:
+        if username not in state['users'] and username not in state['shadow']:
+            add.append(username)
+            continue
+        changes = []
+        if username not in state['databases']:
+            changes.append('create_database')
+        if username not in state['db_users']:
+            changes.append('create_db_user')
+        else:
+            plugin, auth = state['db_users'][username]
+            if passwords or (plugin in ('', 'mysql_native_password') and auth != native_password_hash(password)):
+                changes.append('set_db_password')
+        if username not in state['grants']:
+            changes.append('grant_database')
+        if passwords or shadow_password_matches(password, state['shadow'].get(username, '')) is False:
+            changes.append('set_system_password')
+        if changes:
+            modify[username] = changes
+        else:
+            unchanged += 1
+    wanted = {username for username, _ in roster}
+    to_remove = sorted(state['managed'] - wanted) if remove else []
+    return {'add': add, 'modify': modify, 'remove': to_remove, 'unchanged': unchanged}
+
+def reconcile_statements(username, password, changes):
+    statements = []
+    if 'create_database' in changes:
+        statements.append(f"CREATE DATABASE IF NOT EXISTS `{username}`")
+    if 'create_db_user' in changes:
+        statements.append(("CREATE USER IF NOT EXISTS %s@'localhost' IDENTIFIED BY %s", (username, password)))
+    elif 'set_db_password' in changes:
+        statements.append(("ALTER USER %s@'localhost' IDENTIFIED BY %s", (username, password)))
+    if 'grant_database' in changes or 'create_db_user' in changes:
+        statements.append((f"GRANT ALL PRIVILEGES ON `{username}`.* TO %s@'localhost'", (username,)))
+    return statements
+
+def apply_reconcile(plan, passwords_by_user, progress=None):
+    """Apply a plan: one newusers + SQL batch for additions, one SQL batch and one
+    chpasswd stream for changes, and deletions for removals"""
+    results = []
+    if plan['add']:
+        added, _, _ = provision_users_bulk([(u, passwords_by_user[u]) for u in plan['add']], progress)
+        results.extend(added)
+
+    modified = list(plan['modify'].items())
+    sql_users = [(u, changes) for u, changes in modified if reconcile_statements(u, passwords_by_user[u], changes)]
+    errors = {}
+    if sql_users:
+        try:
+            group_errors = db_execute_groups(
+                [reconcile_statements(u, passwords_by_user[u], changes) for u, changes in sql_users],
+                final=["FLUSH PRIVILEGES"])
+        except Exception as e:
+            group_errors = [e] * len(sql_users)
+        errors = {u: db_error_message(e) for (u, _), e in zip(sql_users, group_errors) if e is not None}
+
+    chpasswd_users = [u for u, changes in modified if 'set_system_password' in changes]
+    if chpasswd_users:
+        lines = ''.join(f"{u}:{passwords_by_user[u]}\n" for u in chpasswd_users)
+        try:
+            with PASSWD_LOCK:
+                run_command(['chpasswd'], input=lines, check=True, capture_output=True, text=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            error_detail = e.stderr.strip() if getattr(e, 'stderr', None) else str(e)
+            for u in chpasswd_users:
+                errors.setdefault(u, error_detail)
+
+    for username, changes in modified:
+        if username in errors:
+            result = {"username": username, "status": "error", "message": f"Failed: {errors[username]}"}
+        else:
+            result = {"username": username, "status": "success", "message": f"Updated: {', '.join(changes)}"}
+        log_action('reconcile_user', username, f"failed: {errors[username]}" if username in errors else 'success')
+        results.append(result)
+        if progress:
+            progress([result])
+
+    if plan['remove']:
+        results.extend(delete_users(plan['remove'], progress, archive=ARCHIVE_ON_DELETE))
+    return results
+
+def request_flag(name):
+    """Boolean option passed as a query string or form field (e.g. ?bulk=1)"""
+    value = request.args.get(name) or request.form.get(name) or ''
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+# Background jobs: long-running operations run on a bounded worker pool. Job state and
+# results live in the state store, so a poll answered by another worker process still finds
+# the job and identical submissions to different workers run once
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='user-manager-job')
+JOB_FIELDS = ['id', 'kind', 'state', 'status', 'total', 'completed', 'message',
+              'created_at', 'started_at', 'finished_at']
+
+def job_key(kind, payload):
+    """Fingerprint of a submission, used to de-duplicate identical concurrent runs"""
+    raw = json.dumps([kind, payload], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def active_job_id(conn, key):
+    """Unfinished job with this fingerprint; one whose worker process died is failed instead"""
+    row = conn.execute("SELECT id, owner_pid FROM jobs WHERE key = ? AND finished_at IS NULL", (key,)).fetchone()
+    if row is None:
+        return None
+    if process_alive(row[1]):
+        return row[0]
+    conn.execute("UPDATE jobs SET state = 'failed', status = 'error', message = 'Job failed: worker process exited', "
+                 "finished_at = ? WHERE id = ?", (time.time(), row[0]))
+    return None
+
+def submit_job(kind, payload, total, work):
+    """Queue `work(progress)` on the job pool.
+
+    `progress(results)` appends one unit's results and advances the counter;
+    the response dict returned by `work` is merged into the job when it completes.
+    Returns (job_id, deduplicated).
+    """
+    key = job_key(kind, payload)
+    job_id = uuid.uuid4().hex
+    with state_transaction() as conn:
+        # Forget finished jobs older than the retention period
+        conn.execute("DELETE FROM jobs WHERE finished_at < ?", (time.time() - JOB_RETENTION_SECONDS,))
+        existing = active_job_id(conn, key)
+        if existing:
+            return existing, True
+        conn.execute("INSERT INTO jobs (id, kind, key, owner_pid, state, status, total, completed, message, created_at) "
+                     "VALUES (?, ?, ?, ?, 'queued', 'success', ?, 0, '', ?)",
+                     (job_id, kind, key, os.getpid(), total, time.time()))
+    position = 0
+
+    def progress(results):
+        nonlocal position
+        with state_transaction() as conn:
+            conn.executemany("INSERT INTO job_results (job_id, position, result) VALUES (?, ?, ?)",
+                             [(job_id, position + i, json.dumps(r, default=str)) for i, r in enumerate(results)])
+            conn.execute("UPDATE jobs SET completed = MIN(total, completed + 1) WHERE id = ?", (job_id,))
+        position += len(results)
+
+    def run():
+        with state_transaction() as conn:
+            conn.execute("UPDATE jobs SET state = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+        try:
+            outcome = dict(work(progress) or {})
+            results = outcome.pop('results', None)
+            status = outcome.pop('status', 'success')
+            message = outcome.pop('message', '')
+            with state_transaction() as conn:
+                if results is not None:
+                    # The final results replace the ones reported along the way
+                    conn.execute("DELETE FROM job_results WHERE job_id = ?", (job_id,))
+                    conn.executemany("INSERT INTO job_results (job_id, position, result) VALUES (?, ?, ?)",
+                                     [(job_id, i, json.dumps(r, default=str)) for i, r in enumerate(results)])
+                conn.execute("UPDATE jobs SET state = 'completed', status = ?, message = ?, outcome = ?, "
+                             "completed = total, finished_at = ? WHERE id = ?",
+                             (status, message, json.dumps(outcome, default=str), time.time(), job_id))
+        except Exception as e:
+            print(f"[!] Job {job_id} ({kind}) failed: {e}")
+            with state_transaction() as conn:
+                conn.execute("UPDATE jobs SET state = 'failed', status = 'error', message = ?, finished_at = ? "
+                             "WHERE id = ?", (f"Job failed: {e}", time.time(), job_id))
+
+    JOB_EXECUTOR.submit(run)
+    return job_id, False
+
+def get_job_view(job_id, since=0):
+    """A job as stored, with its results from position `since` on (None if unknown)"""
+    conn = state_db()
+    row = conn.execute(f"SELECT {', '.join(JOB_FIELDS)}, outcome FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    view = dict(json.loads(row[-1]) if row[-1] else {}, **dict(zip(JOB_FIELDS, row[:-1])))
+    view['results'] = [json.loads(r) for r, in conn.execute(
+        "SELECT result FROM job_results WHERE job_id = ? AND position >= ? ORDER BY position", (job_id, max(0, since)))]
+    view['results_total'] = conn.execute("SELECT COUNT(*) FROM job_results WHERE job_id = ?", (job_id,)).fetchone()[0]
+    return view
+
+def job_accepted(job_id, deduplicated):
+    return jsonify({"status": "accepted", "job_id": job_id, "deduplicated": deduplicated}), 202
+
+def drop_user_databases(usernames):
+    """Drop the users' databases and DB accounts as one batch with a single FLUSH.
+
+    Returns {username: error message or None}.
+    """
+    if not usernames:
+        return {}
+    try:
+        errors = db_execute_groups(
+            [[f"DROP DATABASE IF EXISTS `{username}`", ("DROP USER IF EXISTS %s@'localhost'", (username,))]
+             for username in usernames],
+            final=["FLUSH PRIVILEGES"])
+    except Exception as e:
+        errors = [e] * len(usernames)
+    # DROP USER removed the accounts' grants on shared databases too
+    remove_user_grants([u for u, e in zip(usernames, errors) if e is None])
+    return {u: (db_error_message(e) if e is not None else None) for u, e in zip(usernames, errors)}
+
+@app.before_request
+def start_background_services():
+    # Started lazily so every worker process (e.g. under gunicorn) gets its own threads
+    start_db_size_sampler()
+    start_reaper()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    METRICS.add_gauge('user_manager_http_requests_in_flight', {}, 1)
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses are timed to the first byte; their SQL/file work is timed separately
+    started = g.pop('request_started', None)
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        METRICS.observe('user_manager_http_request_duration_seconds',
+                        {'route': route, 'method': request.method, 'status': str(response.status_code)}, elapsed)
+        if SLOW_OP_THRESHOLD_MS and elapsed * 1000 >= SLOW_OP_THRESHOLD_MS:
+            record_slow_operation('route', f"{request.method} {route}", elapsed, response.status_code >= 500)
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc):
+    METRICS.add_gauge('user_manager_http_requests_in_flight', {}, -1)
+
 @app.route('/')
 def index():
-    user_details = get_user_details()
-    return render_template('index.html', user_details=user_details)
+    user_details, etag, version = get_inventory_snapshot()
+    return conditional_response(f"page-{TEMPLATE_STAMP}-{etag}", lambda: render_template(
+        'index.html', user_details=user_details, inventory_version=version))
+
+@app.route('/inventory', methods=['GET'])
+def inventory():
+    user_details, etag, version = get_inventory_snapshot()
+    since = request.args.get('since')
+    if since is not None:
+        base = inventory_version_number(since)
+        return conditional_response(f"inventory-{etag}-{'full' if base is None else base}",
+                                    lambda: jsonify(inventory_delta(since)))
+    return conditional_response(f"inventory-{etag}", lambda: jsonify({"user_details": user_details, "version": version}))
+
+@app.route('/events', methods=['GET'])
+def events():
+    """Server-sent events: "inventory" deltas (id = inventory version) and new "log" entries"""
+    since = request.args.get('since')
+    # Browsers resend the id of the last inventory event when they reconnect
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id:
+        since = last_event_id
+    subscriber = subscribe_events()
+    if subscriber is None:
+        return jsonify({"status": "error", "message": "Too many event stream clients"}), 503
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            delta = inventory_delta(since)
+            yield format_event('inventory', delta, delta['version'])
+            while True:
+                try:
+                    kind, data, event_id = subscriber['queue'].get(timeout=EVENT_KEEPALIVE)
+                except queue.Empty:
+                    # Also notices passwd/shadow edits made outside this process and stale DB sizes;
+                    # a resulting change is published to the queue and sent on the next pass
+                    get_inventory_snapshot()
+                    yield ": keepalive\n\n"
+                    continue
+                if subscriber['overflow']:
+                    while not subscriber['queue'].empty():
+                        subscriber['queue'].get_nowait()
+                    subscriber['overflow'] = False
+                    delta = inventory_delta(None)
+                    yield format_event('resync', delta, delta['version'])
+                    continue
+                yield format_event(kind, data, event_id)
+        finally:
+            unsubscribe_events(subscriber)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/add_users', methods=['POST'])
 @root_required
 def add_users():
     users_to_add = request.get_json()
-    results = []
-    for user in users_to_add:
-        username = user.get('username')
-        password = user.get('password')
-        if username and password:
-            results.append(create_system_user(username, password))
-            results.append(create_database_user(username, password))
-            log_action('create_user', username, 'success')
-    
-    ssh_update_result = update_ssh_config()
-    results.append(ssh_update_result)
-    
-    return jsonify({"results": results, "user_details": get_user_details()})
+    bulk = request_flag('bulk')
+    since = request_inventory_since()
+
+    def work(progress=None):
+        results = []
+        if bulk:
+            roster = [(user.get('username'), user.get('password')) for user in users_to_add
+                      if user.get('username') and user.get('password')]
+            results, _, _ = provision_users_bulk(roster, progress)
+        else:
+            for user in users_to_add:
+                username = user.get('username')
+                password = user.get('password')
+                if username and password:
+                    user_results = [create_system_user(username, password), create_database_user(username, password)]
+                    log_action('create_user', username, 'success')
+                    results.extend(user_results)
+                    if progress:
+                        progress(user_results)
+
+        ssh_update_result = schedule_ssh_update()
+        results.append(ssh_update_result)
+        invalidate_inventory()
+        return {"results": results, "inventory": inventory_delta(since)}
+
+    if request_flag('async'):
+        return job_accepted(*submit_job('add_users', users_to_add, len(users_to_add), work))
+    return jsonify(work())
 
 @app.route('/upload_users_file', methods=['POST'])
 @root_required
 def upload_users_file():
+    # JSONL/CSV rosters of any size are streamed, either as the multipart "file" or as the raw body
+    fmt = request.args.get('format') or INGEST_CONTENT_TYPES.get(request.mimetype)
+    if fmt is None and 'file' in request.files:
+        fmt = INGEST_FORMATS.get(os.path.splitext(request.files['file'].filename or '')[1].lower())
+    if fmt in ('jsonl', 'csv'):
+        return upload_users_stream(fmt)
+
     # Check if file is present
     if 'file' not in request.files:
         return jsonify({"status": "error", "message": "No file uploaded"}), 400
@@ -286,48 +2196,36 @@ def upload_users_file():
         if not isinstance(user_data, dict):
             return jsonify({"status": "error", "message": "Invalid JSON structure. Expected key-value pairs: {\"username\": \"password\", ...}"}), 400
         
-        results = []
-        valid_count = 0
-        invalid_count = 0
-        
-        for username, password in user_data.items():
-            # Security: Validate username
-            if not is_safe_input(username):
-                results.append({"status": "error", "message": f"Invalid username format: {username}"})
-                invalid_count += 1
-                continue
-            
-            if not password or not isinstance(password, str):
-                results.append({"status": "error", "message": f"Invalid password for: {username}"})
-                invalid_count += 1
-                continue
-            
-            # Create user
-            result_sys = create_system_user(username, password)
-            results.append(result_sys)
-            
-            if result_sys.get('status') == 'success' or result_sys.get('status') == 'warning':
-                result_db = create_database_user(username, password)
-                results.append(result_db)
-                log_action('create_user', username, 'success')
-                valid_count += 1
+        roster = list(user_data.items())
+        bulk = request_flag('bulk')
+        since = request_inventory_since()
+
+        def work(progress=None):
+            # Bulk mode validates the whole roster up front and creates it with a fixed number of commands
+            if bulk:
+                results, valid_count, invalid_count = provision_users_bulk(roster, progress)
             else:
-                invalid_count += 1
-        
-        # Update SSH config
-        ssh_update_result = update_ssh_config()
-        results.append(ssh_update_result)
-        
-        summary = f"Created {valid_count} users successfully."
-        if invalid_count > 0:
-            summary += f" Skipped {invalid_count} invalid entries."
-        
-        return jsonify({
-            "status": "success",
-            "message": summary,
-            "results": results,
-            "user_details": get_user_details()
-        })
+                results, valid_count, invalid_count = provision_users(roster, progress)
+
+            # Update SSH config
+            ssh_update_result = schedule_ssh_update()
+            results.append(ssh_update_result)
+            invalidate_inventory()
+
+            summary = f"Created {valid_count} users successfully."
+            if invalid_count > 0:
+                summary += f" Skipped {invalid_count} invalid entries."
+
+            return {
+                "status": "success",
+                "message": summary,
+                "results": results,
+                "inventory": inventory_delta(since)
+            }
+
+        if request_flag('async'):
+            return job_accepted(*submit_job('upload_users_file', user_data, len(roster), work))
+        return jsonify(work())
         
     except UnicodeDecodeError:
         return jsonify({"status": "error", "message": "Invalid file encoding. Please use UTF-8"}), 400
@@ -335,6 +2233,100 @@ def upload_users_file():
         log_action('upload_file', 'bulk', 'failed')
         return jsonify({"status": "error", "message": "File processing failed"}), 500
 
+def upload_users_stream(fmt):
+    """Provision a JSONL/CSV roster as it is read; problems are reported with line numbers"""
+    stream = request.files['file'].stream if 'file' in request.files else request.stream
+    since = request_inventory_since()
+
+    def summarize(problems, created, skipped):
+        summary = f"Created {created} users successfully."
+        if skipped:
+            summary += f" Skipped {skipped} invalid entries."
+        return {
+            "status": "success",
+            "message": summary,
+            "created": created,
+            "skipped": skipped,
+            "results": problems,
+            "inventory": inventory_delta(since)
+        }
+
+    if not request_flag('async'):
+        return jsonify(summarize(*ingest_roster(stream, fmt)))
+
+    # The job outlives the request, so keep the upload in a private temp file until it is done
+    path, digest, lines = spool_upload(stream)
+
+    def work(progress=None):
+        try:
+            with open(path, 'rb') as f:
+                problems, created, skipped = ingest_roster(f, fmt, progress)
+        finally:
+            os.remove(path)
+        return summarize(problems, created, skipped)
+
+    job_id, deduplicated = submit_job('upload_users_file', {'format': fmt, 'sha256': digest}, lines, work)
+    if deduplicated:
+        os.remove(path)
+    return job_accepted(job_id, deduplicated)
+
+@app.route('/reconcile', methods=['POST'])
+@root_required
+def reconcile():
+    """Bring users, databases and grants in line with a roster; a dry run unless ?apply=1"""
+    payload = request.get_json(silent=True)
+    confirm_remove = None
+    if isinstance(payload, dict) and isinstance(payload.get('users'), (dict, list)):
+        confirm_remove = payload.get('confirm_remove')
+        payload = payload['users']
+    if isinstance(payload, dict):
+        roster = list(payload.items())
+    elif isinstance(payload, list):
+        roster = [(u.get('username'), u.get('password')) for u in payload if isinstance(u, dict)]
+    else:
+        return jsonify({"status": "error", "message": "Expected {\"username\": \"password\", ...}"}), 400
+
+    errors = validate_roster(roster)
+    invalid = [error for error in errors if error is not None]
+    valid = [entry for entry, error in zip(roster, errors) if error is None]
+    try:
+        plan = plan_reconcile(valid, read_current_state(), remove=request_flag('remove'), passwords=request_flag('passwords'))
+    except pymysql.err.MySQLError as e:
+        return jsonify({"status": "error", "message": f"Could not read current state: {db_error_message(e)}"}), 500
+    summary = (f"{len(plan['add'])} to add, {len(plan['modify'])} to update, "
+               f"{len(plan['remove'])} to remove, {plan['unchanged']} unchanged")
+
+    if not request_flag('apply'):
+        return jsonify({"status": "success", "dry_run": True, "message": summary, "plan": plan, "invalid": invalid})
+
+    # Deletions only happen when the caller echoes back the exact removal list of a dry run
+    if plan['remove'] and (not isinstance(confirm_remove, list) or sorted(map(str, confirm_remove)) != plan['remove']):
+        return jsonify({"status": "error", "dry_run": True,
+                        "message": "Removals must be confirmed: send the plan's \"remove\" list as \"confirm_remove\"",
+                        "plan": plan, "invalid": invalid}), 409
+
+    passwords_by_user = dict(valid)
+
+    def work(progress=None):
+        results = apply_reconcile(plan, passwords_by_user, progress)
+        if plan['add'] or plan['remove']:
+            results.append(schedule_ssh_update())
+        invalidate_inventory()
+        failed = sum(1 for r in results if r.get('status') == 'error')
+        return {
+            "status": "error" if failed else "success",
+            "dry_run": False,
+            "message": summary + (f"; {failed} failed" if failed else ""),
+            "plan": plan,
+            "invalid": invalid,
+            "results": results
+        }
+
+    total = len(plan['add']) + len(plan['modify']) + len(plan['remove'])
+    if request_flag('async'):
+        return job_accepted(*submit_job('reconcile', [valid, request.args.to_dict()], total, work))
+    return jsonify(work())
+
 @app.route('/delete_user', methods=['POST'])
 @root_required
 def delete_user():
@@ -344,51 +2336,537 @@ def delete_user():
     if not is_safe_input(username):
         return jsonify({"status": "error", "message": "Invalid username format"}), 400
     
-    try:
-        subprocess.run(['userdel', '-r', username], check=True, capture_output=True)
-        # Fixed: Removed backticks to prevent MySQL syntax error
-        sql = f"DROP DATABASE IF EXISTS {username}; DROP USER IF EXISTS '{username}'@'localhost'; FLUSH PRIVILEGES;"
-        subprocess.run(['mysql', '-e', sql], check=True, capture_output=True, text=True)
-        update_ssh_config()
-        log_action('delete_user', username, 'success')
-        return jsonify({"status": "success", "message": f"User {username} deleted", "user_details": get_user_details()})
-    except subprocess.CalledProcessError as e:
-        error_detail = e.stderr if hasattr(e, 'stderr') and e.stderr else str(e)
-        log_action('delete_user', username, f'failed: {error_detail}')
-        return jsonify({"status": "error", "message": f"Operation failed: {error_detail}"}), 500
-    except Exception as e:
-        log_action('delete_user', username, f'failed: {str(e)}')
-        return jsonify({"status": "error", "message": f"Operation failed: {str(e)}"}), 500
+    since = request_inventory_since()
+    result = delete_users([username], archive=request_flag('archive') or ARCHIVE_ON_DELETE)[0]
+    schedule_ssh_update()
+    invalidate_inventory()
+    if result['status'] != 'success':
+        return jsonify({"status": "error", "message": f"Operation failed: {result['message']}"}), 500
+    return jsonify({"status": "success", "message": f"User {username} deleted", "inventory": inventory_delta(since)})
 
 @app.route('/delete_multiple', methods=['POST'])
 @root_required
 def delete_multiple():
     usernames = request.json.get('usernames', [])
-    results = []
-    
+    since = request_inventory_since()
+    archive = request_flag('archive') or ARCHIVE_ON_DELETE
+
+    def work(progress=None):
+        results = delete_users(usernames, progress, archive=archive)
+        schedule_ssh_update()
+        invalidate_inventory()
+        return {"results": results, "inventory": inventory_delta(since)}
+
+    if request_flag('async'):
+        return job_accepted(*submit_job('delete_multiple', sorted(usernames), len(usernames), work))
+    return jsonify(work())
+
+def delete_users(usernames, progress=None, archive=False):
+    """Delete users in stages so the request returns as soon as access is gone.
+
+    0. with `archive`, their databases are backed up first (see create_backup) and a
+       user whose dump fails is not deleted;
+    1. userdel (without -r) removes each login at once;
+    2. one SQL batch drops all their databases and DB accounts;
+    3. home directories are renamed into a root-only quarantine directory on the same
+       filesystem (O(1)), and the throttled reaper thread deletes the files later.
+    Returns one result per username, in order.
+    """
+    results = {}
+    deleted = []
+    candidates = []
     for username in usernames:
         # Security: Validate input
-        if not is_safe_input(username):
-            results.append({"username": username, "status": "error", "message": "Invalid format"})
-            continue
-            
+        if not is_safe_input(username) or username == 'root':
+            results[username] = {"username": username, "status": "error", "message": "Invalid format"}
+        else:
+            candidates.append(username)
+
+    archived = {}
+    if archive and candidates:
+        try:
+            existing = {row[0] for row in db_query("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA")}
+            targets = {u: 'user' for u in candidates if u in existing}
+            manifest = create_backup(targets, label='delete') if targets else {'id': None, 'databases': {}, 'errors': {}}
+        except Exception as e:
+            manifest = {'id': None, 'databases': {}, 'errors': {u: str(e) for u in candidates}}
+        for username in candidates:
+            if username in manifest['errors']:
+                results[username] = {"username": username, "status": "error",
+                                     "message": f"Not deleted, archive failed: {manifest['errors'][username]}"}
+            else:
+                archived[username] = manifest['id'] if username in manifest['databases'] else None
+        candidates = [u for u in candidates if u in archived]
+
+    for username in candidates:
         try:
-            subprocess.run(['userdel', '-r', username], check=True, capture_output=True)
-            # Fixed: Removed backticks to prevent MySQL syntax error
-            sql = f"DROP DATABASE IF EXISTS {username}; DROP USER IF EXISTS '{username}'@'localhost'; FLUSH PRIVILEGES;"
-            subprocess.run(['mysql', '-e', sql], check=True, capture_output=True, text=True)
-            log_action('delete_user', username, 'success')
-            results.append({"username": username, "status": "success"})
+            entry = pwd.getpwnam(username)
+        except KeyError:
+            entry = None
+        try:
+            with PASSWD_LOCK:
+                run_command(['userdel', username], check=True, capture_output=True, text=True)
+            deleted.append((username, entry))
         except subprocess.CalledProcessError as e:
-            error_detail = e.stderr if hasattr(e, 'stderr') and e.stderr else str(e)
-            log_action('delete_user', username, f'failed: {error_detail}')
-            results.append({"username": username, "status": "error", "message": f"Failed: {error_detail}"})
+            error_detail = e.stderr.strip() if e.stderr else str(e)
+            results[username] = {"username": username, "status": "error", "message": f"Failed: {error_detail}"}
+
+    db_errors = drop_user_databases([username for username, _ in deleted])
+    for username, entry in deleted:
+        problems = []
+        if db_errors.get(username):
+            problems.append(db_errors[username])
+        if entry:
+            try:
+                quarantine_user_files(entry)
+            except OSError as e:
+                problems.append(f"home directory: {e}")
+        if problems:
+            results[username] = {"username": username, "status": "error", "message": f"Failed: {'; '.join(problems)}"}
+        else:
+            results[username] = {"username": username, "status": "success"}
+        if archived.get(username):
+            results[username]['archive'] = archived[username]
+
+    ordered = [results[username] for username in usernames]
+    log_actions([('delete_user', r['username'], 'success' if r['status'] == 'success' else f"failed: {r['message']}")
+                 for r in ordered])
+    if progress:
+        for result in ordered:
+            progress([result])
+    return ordered
+
+# Deferred file removal: deleted home directories wait in a quarantine directory next to
+# them (same filesystem, so moving them there is a rename) until the reaper removes them
+QUARANTINE_DIR_NAME = '.user_manager_quarantine'
+# Quarantine directories outside /home are remembered in the state store's meta table, so
+# a restart (or another worker) still reaps what is left in them
+QUARANTINE_META_PREFIX = 'quarantine_dir:'
+MAIL_SPOOL_DIR = '/var/mail'
+REAPER_FILES_PER_SECOND = float(os.environ.get('USER_MANAGER_REAPER_RATE', '2000'))
+REAPER_SCAN_INTERVAL = float(os.environ.get('USER_MANAGER_REAPER_INTERVAL', '60'))
+REAPER_WAKE = threading.Event()
+REAPER_LOCK = threading.Lock()
+REAPER_STATE = {
+    'thread': None,
+    'dirs': {os.path.join('/home', QUARANTINE_DIR_NAME)},
+    'removed_dirs': 0,
+    'removed_entries': 0,
+    'current': None,
+    'last_error': None
+}
+
+def quarantine_user_files(entry):
+    """Move a deleted user's home directory into quarantine and remove the mail spool"""
+    home = entry.pw_dir.rstrip('/')
+    if home and os.path.isdir(home) and not os.path.islink(home) and os.stat(home).st_uid == entry.pw_uid:
+        quarantine = os.path.join(os.path.dirname(home), QUARANTINE_DIR_NAME)
+        os.makedirs(quarantine, mode=0o700, exist_ok=True)
+        remember_quarantine_dir(quarantine)
+        target = os.path.join(quarantine, f"{entry.pw_name}.{entry.pw_uid}.{int(time.time() * 1000)}")
+        try:
+            os.rename(home, target)
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                # Quarantine on another filesystem: nothing to gain from deferring
+                shutil.rmtree(home)
+            elif e.errno == errno.EBUSY:
+                # Home is a mount point: it can be neither moved nor removed, only emptied
+                with os.scandir(home) as it:
+                    for child in it:
+                        if child.is_dir(follow_symlinks=False):
+                            shutil.rmtree(child.path)
+                        else:
+                            os.unlink(child.path)
+            else:
+                raise
+        else:
+            start_reaper()
+            REAPER_WAKE.set()
+    mail_spool = os.path.join(MAIL_SPOOL_DIR, entry.pw_name)
+    if os.path.isfile(mail_spool):
+        os.remove(mail_spool)
+
+def remember_quarantine_dir(quarantine):
+    """Record a quarantine directory in the state store (once per process)"""
+    with REAPER_LOCK:
+        if quarantine in REAPER_STATE['dirs']:
+            return
+    with state_transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                     (QUARANTINE_META_PREFIX + quarantine, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    with REAPER_LOCK:
+        REAPER_STATE['dirs'].add(quarantine)
+
+def quarantine_dirs():
+    """Every quarantine directory this or an earlier process has used"""
+    with REAPER_LOCK:
+        dirs = set(REAPER_STATE['dirs'])
+    try:
+        rows = state_db().execute("SELECT key FROM meta WHERE key GLOB ?", (QUARANTINE_META_PREFIX + '*',))
+        dirs.update(key[len(QUARANTINE_META_PREFIX):] for key, in rows)
+    except sqlite3.Error as e:
+        print(f"[!] Could not read quarantine directories from the state store: {e}")
+    return dirs
+
+def quarantined_entries():
+    """Paths waiting for the reaper, oldest first"""
+    pending = []
+    for quarantine in quarantine_dirs():
+        try:
+            with os.scandir(quarantine) as it:
+                pending.extend(e.path for e in it if not e.name.startswith('.'))
+        except FileNotFoundError:
+            continue
+    return sorted(pending, key=lambda path: path.rsplit('.', 1)[-1])
+
+def reap_tree(path):
+    """Remove a directory tree at no more than REAPER_FILES_PER_SECOND entries per second"""
+    started = time.monotonic()
+    removed = 0
+
+    def throttle():
+        nonlocal removed
+        removed += 1
+        ahead = removed / REAPER_FILES_PER_SECOND - (time.monotonic() - started)
+        if ahead > 0.05:
+            time.sleep(ahead)
+
+    # Symlinks are unlinked, never followed
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.unlink(os.path.join(root, name))
+            throttle()
+        for name in dirs:
+            child = os.path.join(root, name)
+            if os.path.islink(child):
+                os.unlink(child)
+            else:
+                os.rmdir(child)
+            throttle()
+    os.rmdir(path)
+    return removed + 1
+
+def reaper_loop():
+    while True:
+        REAPER_WAKE.wait(REAPER_SCAN_INTERVAL)
+        REAPER_WAKE.clear()
+        for path in quarantined_entries():
+            lock_path = os.path.join(os.path.dirname(path), '.lock')
+            try:
+                # One reaper per quarantine directory across worker processes
+                with open(lock_path, 'w') as lock_file:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    if not os.path.lexists(path):
+                        continue
+                    with REAPER_LOCK:
+                        REAPER_STATE['current'] = path
+                    with timed('file', 'reaper'):
+                        entries = reap_tree(path)
+                    with REAPER_LOCK:
+                        REAPER_STATE['removed_dirs'] += 1
+                        REAPER_STATE['removed_entries'] += entries
+            except Exception as e:
+                print(f"[!] Could not remove {path}: {e}")
+                with REAPER_LOCK:
+                    REAPER_STATE['last_error'] = f"{path}: {e}"
+            finally:
+                with REAPER_LOCK:
+                    REAPER_STATE['current'] = None
+
+def start_reaper():
+    with REAPER_LOCK:
+        if REAPER_STATE['thread'] is not None:
+            return
+        thread = threading.Thread(target=reaper_loop, name='user-manager-reaper', daemon=True)
+        REAPER_STATE['thread'] = thread
+    thread.start()
+
+@app.route('/reaper_status', methods=['GET'])
+def reaper_status():
+    pending = quarantined_entries()
+    with REAPER_LOCK:
+        state = {k: v for k, v in REAPER_STATE.items() if k not in ('thread', 'dirs')}
+    return jsonify(dict(state, status="success", pending=len(pending),
+                        pending_users=[os.path.basename(p).rsplit('.', 2)[0] for p in pending],
+                        files_per_second=REAPER_FILES_PER_SECOND))
+
+# Database backups: every database is dumped by its own mysqldump on a bounded pool and
+# streamed through gzip straight to BACKUP_DIR/<backup id>/<db>.sql.gz. manifest.json (sizes
+# and SHA-256 of every file) is written last; a directory without one is incomplete.
+BACKUP_EXECUTOR = ThreadPoolExecutor(max_workers=BACKUP_WORKERS, thread_name_prefix='user-manager-backup')
+BACKUP_BLOCK_SIZE = 1024 * 1024
+BACKUP_ID_PATTERN = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}(-[a-zA-Z0-9_]+)?$')
+
+class ChecksumWriter:
+    """File wrapper that hashes and counts everything written through it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+def mysql_client_command(program, *args):
+    """(argv, env) for a MariaDB client program using the app's connection settings"""
+    argv = [program]
+    if DB_SOCKET:
+        argv.append(f'--socket={DB_SOCKET}')
+    else:
+        argv += [f'--host={DB_HOST}', f'--port={DB_PORT}']
+    argv.append(f'--user={DB_USER}')
+    env = dict(os.environ)
+    if DB_PASSWORD:
+        # Security: Pass the password in the environment, never on the command line
+        env['MYSQL_PWD'] = DB_PASSWORD
+    return argv + list(args), env
+
+def command_error(stderr_file, returncode):
+    stderr_file.seek(0)
+    lines = stderr_file.read().decode('utf-8', 'replace').strip().splitlines()
+    return lines[-1] if lines else f"exit status {returncode}"
+
+def dump_database(db_name, path):
+    """Stream one mysqldump through gzip into `path`; returns its manifest entry"""
+    argv, env = mysql_client_command('mysqldump', '--single-transaction', '--quick', '--routines',
+                                     '--triggers', '--events', '--databases', db_name)
+    started = time.monotonic()
+    partial = path + '.part'
+    raw_bytes = 0
+    with timed('command', 'mysqldump') as op, tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=stderr_file, env=env)
+        returncode = None
+        try:
+            with open(partial, 'wb') as f:
+                sink = ChecksumWriter(f)
+                with gzip.GzipFile(filename=f"{db_name}.sql", mode='wb', fileobj=sink,
+                                   compresslevel=BACKUP_COMPRESSION_LEVEL, mtime=0) as gz:
+                    while True:
+                        block = proc.stdout.read(BACKUP_BLOCK_SIZE)
+                        if not block:
+                            break
+                        raw_bytes += len(block)
+                        gz.write(block)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+            if returncode != 0 and os.path.exists(partial):
+                os.remove(partial)
+        if returncode != 0:
+            op.failed = True
+            raise RuntimeError(command_error(stderr_file, returncode))
+    os.rename(partial, path)
+    return {
+        "file": os.path.basename(path),
+        "bytes": raw_bytes,
+        "compressed_bytes": sink.size,
+        "sha256": sink.sha256.hexdigest(),
+        "seconds": round(time.monotonic() - started, 3)
+    }
+
+def create_backup(databases, label=None, progress=None):
+    """Dump `databases` ({name: 'user' or 'shared'}) in parallel into a new backup; returns its manifest"""
+    backup_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}" + (f"-{label}" if label else '')
+    directory = os.path.join(BACKUP_DIR, backup_id)
+    # Security: Dumps hold every user's data; only root may read them
+    os.makedirs(BACKUP_DIR, mode=0o700, exist_ok=True)
+    os.mkdir(directory, mode=0o700)
+
+    futures = {BACKUP_EXECUTOR.submit(dump_database, name, os.path.join(directory, f"{name}.sql.gz")): name
+               for name in databases}
+    entries, errors = {}, {}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            entries[name] = dict(future.result(), kind=databases[name])
+            result = {"database": name, "status": "success", "compressed_bytes": entries[name]['compressed_bytes']}
         except Exception as e:
-            log_action('delete_user', username, f'failed: {str(e)}')
-            results.append({"username": username, "status": "error", "message": f"Failed: {str(e)}"})
-    
-    update_ssh_config()
-    return jsonify({"results": results, "user_details": get_user_details()})
+            print(f"[!] Backup of {name} failed: {e}")
+            errors[name] = str(e)
+            result = {"database": name, "status": "error", "message": f"Backup failed: {e}"}
+        if progress:
+            progress([result])
+
+    manifest = {
+        "id": backup_id,
+        "created_at": datetime.now().isoformat(timespec='seconds'),
+        "label": label,
+        "databases": {name: entries[name] for name in sorted(entries)},
+        "errors": errors,
+        "bytes": sum(e['bytes'] for e in entries.values()),
+        "compressed_bytes": sum(e['compressed_bytes'] for e in entries.values())
+    }
+    with open(os.path.join(directory, 'manifest.json.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(directory, 'manifest.json.tmp'), os.path.join(directory, 'manifest.json'))
+    log_action('backup', backup_id, 'success' if not errors else f"failed: {', '.join(sorted(errors))}")
+    return manifest
+
+def load_backup_manifest(backup_id):
+    """Manifest of a complete backup, or None"""
+    # Security: The id becomes a path; only accept ids that create_backup generates
+    if not isinstance(backup_id, str) or not BACKUP_ID_PATTERN.match(backup_id):
+        return None
+    try:
+        with open(os.path.join(BACKUP_DIR, backup_id, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BACKUP_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def restore_database(backup_id, db_name, entry):
+    """Verify one dump against the manifest, then stream it through gunzip into mysql"""
+    path = os.path.join(BACKUP_DIR, backup_id, entry['file'])
+    if file_sha256(path) != entry['sha256']:
+        raise RuntimeError("checksum mismatch, dump file is damaged")
+    argv, env = mysql_client_command('mysql')
+    with timed('command', 'mysql') as op, tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file, env=env)
+        try:
+            with gzip.open(path, 'rb') as gz:
+                for block in iter(lambda: gz.read(BACKUP_BLOCK_SIZE), b''):
+                    proc.stdin.write(block)
+        except BrokenPipeError:
+            # mysql gave up early; its exit status and message say why
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = proc.wait()
+        if returncode != 0:
+            op.failed = True
+            raise RuntimeError(command_error(stderr_file, returncode))
+
+def restore_backup(manifest, databases, progress=None):
+    """Restore the listed databases of a backup in parallel; one result per database"""
+    futures = {BACKUP_EXECUTOR.submit(restore_database, manifest['id'], name, manifest['databases'][name]): name
+               for name in databases}
+    results = {}
+    for future in as_completed(futures):
+        name = futures[future]
+        try:
+            future.result()
+            results[name] = {"database": name, "status": "success"}
+        except Exception as e:
+            print(f"[!] Restore of {name} failed: {e}")
+            results[name] = {"database": name, "status": "error", "message": f"Restore failed: {e}"}
+        if progress:
+            progress([results[name]])
+    ordered = [results[name] for name in databases]
+    log_actions([('restore', f"{r['database']} from {manifest['id']}",
+                  'success' if r['status'] == 'success' else f"failed: {r['message']}") for r in ordered])
+    return ordered
+
+@app.route('/backup', methods=['POST'])
+@root_required
+def backup():
+    """Back up {"databases": [...]} or {"users": [...]}; every user and shared database by default"""
+    payload = request.get_json(silent=True) or {}
+    label = payload.get('label')
+    if label is not None and not is_safe_input(label):
+        return jsonify({"status": "error", "message": "Invalid label format"}), 400
+    names = payload.get('databases') or payload.get('users')
+    if names is not None and (not isinstance(names, list) or not all(is_safe_input(n) for n in names)):
+        return jsonify({"status": "error", "message": "Invalid database name format"}), 400
+
+    try:
+        existing = {row[0] for row in db_query("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA")}
+    except pymysql.err.MySQLError as e:
+        return jsonify({"status": "error", "message": f"Could not list databases: {db_error_message(e)}"}), 500
+    shared = set(list_shared_dbs())
+    if names is None:
+        names = [u for u in get_system_users() if u != 'root'] + sorted(shared)
+    missing = [n for n in names if n not in existing]
+    targets = {n: 'shared' if n in shared else 'user' for n in names if n in existing}
+    if not targets:
+        return jsonify({"status": "error", "message": "No matching databases to back up", "missing": missing}), 400
+
+    def work(progress=None):
+        manifest = create_backup(targets, label, progress)
+        return {
+            "status": "error" if manifest['errors'] else "success",
+            "message": f"Backed up {len(manifest['databases'])} of {len(targets)} databases to {manifest['id']}",
+            "backup": manifest,
+            "missing": missing
+        }
+
+    if request_flag('async'):
+        return job_accepted(*submit_job('backup', [sorted(targets), label], len(targets), work))
+    return jsonify(work())
+
+@app.route('/backups', methods=['GET'])
+def list_backups():
+    """Backups newest first; directories without a manifest are still being written or failed"""
+    backups = []
+    try:
+        names = sorted(os.listdir(BACKUP_DIR), reverse=True)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not BACKUP_ID_PATTERN.match(name):
+            continue
+        manifest = load_backup_manifest(name)
+        if manifest is None:
+            backups.append({"id": name, "complete": False})
+        else:
+            backups.append({"id": name, "complete": True, "created_at": manifest['created_at'],
+                            "label": manifest['label'], "databases": len(manifest['databases']),
+                            "errors": len(manifest['errors']), "compressed_bytes": manifest['compressed_bytes']})
+    return jsonify({"status": "success", "backups": backups})
+
+@app.route('/backups/<backup_id>', methods=['GET'])
+def get_backup(backup_id):
+    manifest = load_backup_manifest(backup_id)
+    if manifest is None:
+        return jsonify({"status": "error", "message": "Backup not found"}), 404
+    return jsonify(dict(manifest, status="success"))
+
+@app.route('/restore', methods=['POST'])
+@root_required
+def restore():
+    """Restore {"backup": id, "databases": [...]} (all databases in the backup by default)"""
+    payload = request.get_json(silent=True) or {}
+    manifest = load_backup_manifest(payload.get('backup'))
+    if manifest is None:
+        return jsonify({"status": "error", "message": "Backup not found"}), 404
+    databases = payload.get('databases') or list(manifest['databases'])
+    if not isinstance(databases, list) or not all(is_safe_input(n) for n in databases):
+        return jsonify({"status": "error", "message": "Invalid database name format"}), 400
+    unknown = [n for n in databases if n not in manifest['databases']]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Not in backup {manifest['id']}: {', '.join(map(str, unknown))}"}), 400
+
+    def work(progress=None):
+        results = restore_backup(manifest, databases, progress)
+        failed = sum(1 for r in results if r['status'] != 'success')
+        invalidate_inventory(db_sizes=True)
+        return {
+            "status": "error" if failed else "success",
+            "message": f"Restored {len(results) - failed} of {len(results)} databases from {manifest['id']}",
+            "results": results
+        }
+
+    if request_flag('async'):
+        return job_accepted(*submit_job('restore', [manifest['id'], sorted(databases)], len(databases), work))
+    return jsonify(work())
 
 @app.route('/reset_password', methods=['POST'])
 @root_required
@@ -400,11 +2878,15 @@ def reset_password():
     if not is_safe_input(username):
         return jsonify({"status": "error", "message": "Invalid username format"}), 400
     
+    if validate_roster([(username, new_password)])[0] is not None:
+        return jsonify({"status": "error", "message": "Invalid password"}), 400
+
     try:
-        command = f"echo '{username}:{new_password}' | chpasswd"
-        subprocess.run(command, shell=True, check=True, capture_output=True)
-        sql = f"SET PASSWORD FOR '{username}'@'localhost' = PASSWORD('{new_password}');"
-        subprocess.run(['mysql', '-e', sql], check=True, capture_output=True)
+        # Pre-hashed and passed on stdin: the password never reaches a shell or argv
+        with PASSWD_LOCK:
+            run_command(['chpasswd', '-e'], input=f"{username}:{sha512_crypt(new_password)}\n",
+                        check=True, capture_output=True, text=True)
+        db_execute("ALTER USER %s@'localhost' IDENTIFIED BY %s", (username, new_password))
         # Security: Never store passwords in plain text
         log_action('reset_password', username, 'success')
         return jsonify({"status": "success", "message": "Password updated"})
@@ -412,6 +2894,121 @@ def reset_password():
         log_action('reset_password', username, 'failed')
         return jsonify({"status": "error", "message": "Operation failed"}), 500
 
+HASH_POOL = None
+HASH_POOL_LOCK = threading.Lock()
+
+def hash_passwords(passwords):
+    """SHA-512 crypt hashes for many passwords, spread over a process pool"""
+    global HASH_POOL
+    if len(passwords) < HASH_INLINE_BELOW or HASH_WORKERS <= 1:
+        return [sha512_crypt(p) for p in passwords]
+    with HASH_POOL_LOCK:
+        if HASH_POOL is None:
+            # spawn, not fork: forking a process that runs request and job threads is unsafe
+            HASH_POOL = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    chunksize = max(1, len(passwords) // (HASH_WORKERS * 4))
+    return list(HASH_POOL.map(sha512_crypt, passwords, chunksize=chunksize))
+
+def generate_password(length=GENERATED_PASSWORD_LENGTH):
+    alphabet = 'ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnpqrstuvwxyz23456789'
+    return ''.join(secrets.choice(alphabet) for _ in range(length))
+
+def rotate_passwords(roster, generated=(), progress=None):
+    """Set new passwords for (username, password) pairs.
+
+    System passwords are hashed up front and applied with one `chpasswd -e`
+    stream; DB passwords with one batch of ALTER USER on a single connection.
+    Returns one result per user; generated passwords are included once.
+    """
+    hashes = hash_passwords([password for _, password in roster])
+    lines = ''.join(f"{username}:{hashed}\n" for (username, _), hashed in zip(roster, hashes))
+    system_error = None
+    try:
+        with PASSWD_LOCK:
+            run_command(['chpasswd', '-e'], input=lines, check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        # chpasswd applies all lines or none
+        system_error = e.stderr.strip() if getattr(e, 'stderr', None) else str(e)
+
+    # Without the system password change the DB password is left alone, so the two
+    # never diverge and no generated password is applied without being returned
+    db_errors = [None] * len(roster)
+    if not system_error:
+        try:
+            db_errors = db_execute_groups(
+                [[("ALTER USER %s@'localhost' IDENTIFIED BY %s", (username, password))] for username, password in roster])
+        except Exception as e:
+            db_errors = [e] * len(roster)
+
+    results, log_entries = [], []
+    for (username, password), db_error in zip(roster, db_errors):
+        problems = []
+        if system_error:
+            problems.append(f"system password: {system_error}; DB password not changed")
+        if db_error is not None:
+            problems.append(f"DB password: {db_error_message(db_error)}")
+        result = {"username": username, "status": "error" if problems else "success",
+                  "message": '; '.join(problems) if problems else "Password updated"}
+        if username in generated and not system_error:
+            result['password'] = password
+        results.append(result)
+        log_entries.append(('reset_password', username, 'success' if not problems else f"failed: {'; '.join(problems)}"))
+        if progress:
+            progress([result])
+    log_actions(log_entries)
+    return results
+
+@app.route('/rotate_passwords', methods=['POST'])
+@root_required
+def rotate_passwords_route():
+    """Rotate many passwords at once.
+
+    Body: {"passwords": {"user": "new password", ...}} to set given passwords and/or
+    {"generate": ["user", ...]} (or "generate": "all" for every managed user) to set
+    random ones, which are returned once in the results.
+    """
+    body = request.get_json(silent=True) or {}
+    given = body.get('passwords') or {}
+    generate = body.get('generate') or []
+    if not isinstance(given, dict) or not (isinstance(generate, list) or generate == 'all'):
+        return jsonify({"status": "error", "message": "Expected {\"passwords\": {...}} and/or {\"generate\": [...]}"}), 400
+    if generate == 'all':
+        # Only the student accounts the app manages: login users with their own DB account
+        try:
+            db_accounts = {row[0] for row in db_query("SELECT User FROM mysql.user WHERE Host = 'localhost'")}
+        except pymysql.err.MySQLError as e:
+            return jsonify({"status": "error", "message": f"Could not list DB accounts: {db_error_message(e)}"}), 500
+        generate = sorted(p.pw_name for p in pwd.getpwall() if is_login_account(p) and p.pw_name in db_accounts)
+
+    roster = list(given.items()) + [(u, generate_password()) for u in generate if u not in given]
+    errors = validate_roster(roster)
+    existing = {p.pw_name for p in pwd.getpwall()}
+    results, valid = [], []
+    for (username, password), error in zip(roster, errors):
+        if error is not None:
+            results.append(dict(error, username=username))
+        elif username == 'root' or username not in existing:
+            results.append({"username": username, "status": "error", "message": "No such user"})
+        else:
+            valid.append((username, password))
+    if not valid:
+        return jsonify({"status": "error", "message": "No valid users", "results": results}), 400
+
+    generated = set(generate) - set(given)
+
+    def work(progress=None):
+        rotated = rotate_passwords(valid, generated, progress)
+        failed = sum(1 for r in rotated + results if r['status'] != 'success')
+        return {
+            "status": "error" if failed else "success",
+            "message": f"Rotated {len(rotated) - sum(1 for r in rotated if r['status'] != 'success')} of {len(roster)} passwords",
+            "results": results + rotated
+        }
+
+    if request_flag('async'):
+        return job_accepted(*submit_job('rotate_passwords', [u for u, _ in valid], len(valid), work))
+    return jsonify(work())
+
 @app.route('/toggle_lock', methods=['POST'])
 @root_required
 def toggle_lock():
@@ -425,13 +3022,16 @@ def toggle_lock():
     if action not in ['lock', 'unlock']:
         return jsonify({"status": "error", "message": "Invalid action"}), 400
     
+    since = request_inventory_since()
     try:
-        if action == 'lock':
-            subprocess.run(['usermod', '-L', username], check=True, capture_output=True)
-        else:
-            subprocess.run(['usermod', '-U', username], check=True, capture_output=True)
+        with PASSWD_LOCK:
+            if action == 'lock':
+                run_command(['usermod', '-L', username], check=True, capture_output=True)
+            else:
+                run_command(['usermod', '-U', username], check=True, capture_output=True)
+        invalidate_inventory()
         log_action(f'{action}_user', username, 'success')
-        return jsonify({"status": "success", "user_details": get_user_details()})
+        return jsonify({"status": "success", "inventory": inventory_delta(since)})
     except Exception as e:
         return jsonify({"status": "error", "message": "Operation failed"}), 500
 
@@ -445,14 +3045,10 @@ def create_shared_db():
         return jsonify({"status": "error", "message": "Invalid database name format"}), 400
     
     try:
-        sql = f"CREATE DATABASE IF NOT EXISTS `{db_name}`;"
-        subprocess.run(['mysql', '-e', sql], check=True, capture_output=True)
-        data = load_data()
-        if db_name not in data['shared_dbs']:
-            data['shared_dbs'].append(db_name)
-            save_data(data)
+        db_execute(f"CREATE DATABASE IF NOT EXISTS `{db_name}`")
+        add_shared_db(db_name)
         log_action('create_shared_db', db_name, 'success')
-        return jsonify({"status": "success", "message": f"Database {db_name} created", "shared_dbs": data['shared_dbs']})
+        return jsonify({"status": "success", "message": f"Database {db_name} created", "shared_dbs": list_shared_dbs()})
     except Exception as e:
         return jsonify({"status": "error", "message": "Operation failed"}), 500
 
@@ -468,8 +3064,11 @@ def grant_access():
     
     try:
         # Grant specific privileges for working *inside* the database
-        sql = f"GRANT SELECT, INSERT, UPDATE, DELETE, CREATE, DROP, ALTER, INDEX, REFERENCES, CREATE TEMPORARY TABLES, LOCK TABLES, EXECUTE, CREATE VIEW, SHOW VIEW, CREATE ROUTINE, ALTER ROUTINE, TRIGGER ON `{db_name}`.* TO '{username}'@'localhost'; FLUSH PRIVILEGES;"
-        subprocess.run(['mysql', '-e', sql], check=True, capture_output=True)
+        db_execute_script([
+            (f"GRANT {SHARED_DB_PRIVILEGES} ON `{db_name}`.* TO %s@'localhost'", (username,)),
+            "FLUSH PRIVILEGES"
+        ])
+        record_grants([(db_name, username)])
         log_action('grant_access', f'{username} to {db_name}', 'success')
         return jsonify({"status": "success", "message": f"Table/object management access granted to {username} on {db_name}"})
     except Exception as e:
@@ -487,18 +3086,355 @@ def revoke_access():
         return jsonify({"status": "error", "message": "Invalid input format"}), 400
     
     try:
-        sql = f"REVOKE ALL PRIVILEGES ON `{db_name}`.* FROM '{username}'@'localhost'; FLUSH PRIVILEGES;"
-        subprocess.run(['mysql', '-e', sql], check=True, capture_output=True)
+        db_execute_script([
+            (f"REVOKE ALL PRIVILEGES ON `{db_name}`.* FROM %s@'localhost'", (username,)),
+            "FLUSH PRIVILEGES"
+        ])
+        remove_grants([(db_name, username)])
         log_action('revoke_access', f'{username} from {db_name}', 'success')
         return jsonify({"status": "success", "message": f"Access revoked from {username}"})
     except Exception as e:
         return jsonify({"status": "error", "message": "Operation failed"}), 500
 
+def access_pairs(spec):
+    """(db_name, username) pairs of a {"users": [...], "databases": [...]} matrix"""
+    if not spec:
+        return []
+    if not isinstance(spec, dict) or not isinstance(spec.get('users'), list) or not isinstance(spec.get('databases'), list):
+        raise ValueError('Expected {"users": [...], "databases": [...]}')
+    # Security: Validate every name before expanding the matrix
+    invalid = [name for name in spec['users'] + spec['databases'] if not is_safe_input(name)]
+    if invalid:
+        raise ValueError(f"Invalid user or database name: {invalid[0]!r}")
+    return [(db, user) for db in dict.fromkeys(spec['databases']) for user in dict.fromkeys(spec['users'])]
+
+@app.route('/access_matrix', methods=['GET'])
+def get_access_matrix():
+    """Current grants on every shared database, from one mysql.db query"""
+    shared_dbs = list_shared_dbs()
+    matrix = {db: [] for db in shared_dbs}
+    if shared_dbs:
+        placeholders = ', '.join(['%s'] * len(shared_dbs))
+        rows = db_query(f"SELECT Db, User FROM mysql.db WHERE Host = 'localhost' AND Db IN ({placeholders}) "
+                        "ORDER BY Db, User", tuple(shared_dbs))
+        for db, user in rows:
+            matrix[db].append(user)
+    users = sorted({user for granted in matrix.values() for user in granted})
+    return jsonify({"status": "success", "databases": shared_dbs, "users": users, "matrix": matrix})
+
+@app.route('/access_matrix', methods=['POST'])
+@root_required
+def update_access_matrix():
+    """Apply many grants and revokes on one connection with a single FLUSH PRIVILEGES.
+
+    Body: {"grant": {"users": [...], "databases": [...]}, "revoke": {...}}; every
+    user x database pair of each side is applied. Returns one outcome per pair.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        requested = [('grant', pair) for pair in access_pairs(body.get('grant'))]
+        requested += [('revoke', pair) for pair in access_pairs(body.get('revoke'))]
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not requested:
+        return jsonify({"status": "error", "message": "Nothing to grant or revoke"}), 400
+
+    shared_dbs = set(list_shared_dbs())
+    both = {pair for action, pair in requested if action == 'grant'} & {pair for action, pair in requested if action == 'revoke'}
+    outcomes, to_apply = [], []
+    for action, (db_name, username) in requested:
+        outcome = {"db_name": db_name, "username": username, "action": action}
+        # Security: Validate input
+        if not is_safe_input(db_name) or not is_safe_input(username):
+            outcome.update(status="error", message="Invalid input format")
+        elif db_name not in shared_dbs:
+            outcome.update(status="error", message=f"{db_name} is not a shared database")
+        elif (db_name, username) in both:
+            outcome.update(status="error", message="Pair is both granted and revoked")
+        else:
+            to_apply.append((action, db_name, username, outcome))
+        outcomes.append(outcome)
+
+    if to_apply:
+        groups = []
+        for action, db_name, username, _ in to_apply:
+            if action == 'grant':
+                groups.append([(f"GRANT {SHARED_DB_PRIVILEGES} ON `{db_name}`.* TO %s@'localhost'", (username,))])
+            else:
+                groups.append([(f"REVOKE ALL PRIVILEGES ON `{db_name}`.* FROM %s@'localhost'", (username,))])
+        try:
+            errors = db_execute_groups(groups, final=["FLUSH PRIVILEGES"])
+        except Exception as e:
+            errors = [e] * len(to_apply)
+        for (action, db_name, username, outcome), error in zip(to_apply, errors):
+            if error is None:
+                outcome.update(status="success")
+            else:
+                outcome.update(status="error", message=db_error_message(error))
+        applied = [(action, db_name, username) for action, db_name, username, outcome in to_apply if outcome['status'] == 'success']
+        record_grants([(db, user) for action, db, user in applied if action == 'grant'])
+        remove_grants([(db, user) for action, db, user in applied if action == 'revoke'])
+        log_actions([(f'{action}_access', f"{username} {'to' if action == 'grant' else 'from'} {db_name}",
+                      'success' if outcome['status'] == 'success' else f"failed: {outcome['message']}")
+                     for action, db_name, username, outcome in to_apply])
+
+    failed = sum(1 for o in outcomes if o['status'] != 'success')
+    return jsonify({
+        "status": "error" if failed else "success",
+        "message": f"{len(outcomes) - failed} of {len(outcomes)} changes applied",
+        "results": outcomes
+    })
+
+# Shared DB queries: row limits are enforced server-side and every query runs under a timeout
+QUERY_DEFAULT_LIMIT = 1000
+QUERY_MAX_LIMIT = int(os.environ.get('USER_MANAGER_QUERY_MAX_LIMIT', '10000'))
+QUERY_DEFAULT_TIMEOUT = 30
+QUERY_MAX_TIMEOUT = int(os.environ.get('USER_MANAGER_QUERY_MAX_TIMEOUT', '300'))
+TRAILING_LIMIT_RE = re.compile(r'\bLIMIT\s+(\d+)(?:\s*(,|OFFSET)\s*(\d+))?\s*$', re.IGNORECASE)
+# Quoted text is matched first so comment markers inside literals are left alone
+LINE_COMMENT_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|(?:--(?=\s|$)|#)[^\n]*")
+STRING_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+LOCKING_READ_RE = re.compile(r'\b(FOR\s+(UPDATE|SHARE)|LOCK\s+IN\s+SHARE\s+MODE)\b', re.IGNORECASE)
+FIELD_TYPE_NAMES = {v: k for k, v in vars(pymysql.constants.FIELD_TYPE).items() if isinstance(v, int)}
+
+def paged_query_sql(query, limit, offset):
+    """Add the page window to a SELECT (one extra row tells whether more rows exist).
+
+    Returns (sql, paged). Other statements, and locking reads (FOR UPDATE, LOCK IN
+    SHARE MODE) where the window cannot go last, run as-is and are sliced client-side.
+    """
+    # A trailing -- or # comment would swallow the appended LIMIT
+    q = LINE_COMMENT_RE.sub(lambda m: m.group(1) or '', query).strip().rstrip(';').strip()
+    if q.split(None, 1)[0].upper() != 'SELECT' or LOCKING_READ_RE.search(STRING_LITERAL_RE.sub("''", q)):
+        return q, False
+    own_limit = TRAILING_LIMIT_RE.search(q)
+    if own_limit:
+        # The query has its own LIMIT: narrow it to the page (no subquery, so duplicate
+        # column names still work)
+        first, sep, second = own_limit.groups()
+        if sep == ',':
+            own_offset, own_count = int(first), int(second)
+        else:
+            own_offset, own_count = int(second or 0), int(first)
+        window = max(0, min(limit + 1, own_count - offset))
+        return f"{q[:own_limit.start()]}LIMIT {window} OFFSET {own_offset + offset}", True
+    return f"{q} LIMIT {limit + 1} OFFSET {offset}", True
+
+def json_safe(value):
+    """Convert a column value to a JSON type (exact decimals are kept as strings)"""
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return bytes(value).decode('utf-8')
+        except UnicodeDecodeError:
+            return bytes(value).hex()
+    return value
+
+def column_metadata(description):
+    return [{'name': col[0], 'type': FIELD_TYPE_NAMES.get(col[1], str(col[1])), 'nullable': bool(col[6])}
+            for col in description]
+
+def handler_reads(conn):
+    """Rows read by the storage engines in this session (sum of Handler_read_* counters)"""
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW SESSION STATUS LIKE 'Handler_read%'")
+        return sum(int(value) for _, value in cursor.fetchall())
+
+def iter_shared_query(db_name, query, limit, offset, timeout):
+    """Run a shared DB query, yielding ('columns', meta), ('row', values)... and ('stats', stats).
+
+    Rows are read unbuffered, so nothing beyond the requested page is held in memory.
+    """
+    sql, paged = paged_query_sql(query, limit, offset)
+    started = time.monotonic()
+    returned = 0
+    has_more = False
+    affected_rows = None
+    with timed('sql', 'shared_query'), DB_POOL.connection() as conn:
+        _prepare_connection(conn, db_name, timeout)
+        # SHOW SESSION STATUS bumps the Handler_read counters itself: measure its own cost
+        # with a back-to-back pair and take it off the result
+        baseline = handler_reads(conn)
+        reads_before = handler_reads(conn)
+        status_overhead = reads_before - baseline
+        with statement_watchdog(conn, timeout):
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(sql)
+                if cursor.description is None:
+                    affected_rows = cursor.rowcount
+                else:
+                    yield 'columns', column_metadata(cursor.description)
+                    skip = 0 if paged else offset
+                    for row in cursor.fetchall_unbuffered():
+                        if skip:
+                            skip -= 1
+                            continue
+                        if returned >= limit:
+                            has_more = True
+                            if paged:
+                                break
+                            continue
+                        returned += 1
+                        yield 'row', [json_safe(v) for v in row]
+            finally:
+                cursor.close()
+        rows_scanned = max(0, handler_reads(conn) - reads_before - status_overhead)
+    yield 'stats', {
+        'rows_returned': returned,
+        'rows_scanned': rows_scanned,
+        'affected_rows': affected_rows,
+        'elapsed_ms': round((time.monotonic() - started) * 1000, 1),
+        'limit': limit,
+        'offset': offset,
+        'has_more': has_more,
+        'next_offset': offset + returned if has_more else None
+    }
+
+# Result cache for read-only shared DB queries, invalidated by writes through /query_shared_db
+QUERY_CACHE_MAX_BYTES = int(os.environ.get('USER_MANAGER_QUERY_CACHE_BYTES', str(32 * 1024 * 1024)))
+QUERY_CACHE_TTL = float(os.environ.get('USER_MANAGER_QUERY_CACHE_TTL', '60'))  # 0 disables expiry
+READ_ONLY_QUERY_RE = re.compile(r'^\s*(SELECT|SHOW|DESCRIBE|DESC)\b', re.IGNORECASE)
+# Results that can differ between two runs of the same text are never cached
+VOLATILE_QUERY_RE = re.compile(
+    r'\b(NOW|SYSDATE|CURDATE|CURTIME|CURRENT_DATE|CURRENT_TIME|CURRENT_TIMESTAMP|UNIX_TIMESTAMP|RAND|UUID|UUID_SHORT'
+    r'|CONNECTION_ID|LAST_INSERT_ID|FOUND_ROWS|ROW_COUNT|SLEEP|BENCHMARK|USER|CURRENT_USER)\b|\bFOR\s+UPDATE\b|\bLOCK\s+IN\b|@',
+    re.IGNORECASE)
+QUOTED_OR_SPACE_RE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`)|\s+")
+# A write naming `db`.`table` (or alias.column, treated the same) may touch other databases
+QUALIFIED_NAME_RE = re.compile(r'[A-Za-z0-9_$`]\s*\.\s*[A-Za-z_$`]')
+
+def normalize_query(query):
+    """Cache key text: whitespace collapsed outside quotes, trailing semicolons dropped"""
+    collapsed = QUOTED_OR_SPACE_RE.sub(lambda m: m.group(1) or ' ', query.strip())
+    return collapsed.rstrip(';').strip()
+
+# Write generations live in the state store's meta table, so a write through any worker
+# process makes every worker's cached results for that database stale
+QUERY_CACHE_GENERATION_PREFIX = 'query_cache_generation:'
+
+class QueryResultCache:
+    """Memory-bounded LRU of query results keyed by database and normalized query"""
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (db_name, value, size, stored_at, generation)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[4] != generation:
+                # Written since it was stored (possibly through another worker)
+                self._remove(key)
+                self.invalidations += 1
+                entry = None
+            if entry is not None and self.ttl and time.monotonic() - entry[3] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, db_name):
+        """(all-databases, this database) write counters; take before a read, pass to get() and put()"""
+        keys = (QUERY_CACHE_GENERATION_PREFIX + '*', QUERY_CACHE_GENERATION_PREFIX + db_name)
+        values = dict(state_db().execute("SELECT key, value FROM meta WHERE key IN (?, ?)", keys))
+        return tuple(int(values.get(key, 0)) for key in keys)
+
+    def _bump(self, name):
+        with state_transaction() as conn:
+            conn.execute("INSERT INTO meta (key, value) VALUES (?, '1') "
+                         "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                         (QUERY_CACHE_GENERATION_PREFIX + name,))
+
+    def put(self, key, db_name, value, generation):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes // 4:
+            return
+        if generation != self.generation(db_name):
+            # A write finished while the query ran: the result may predate it
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (db_name, value, size, time.monotonic(), generation)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_db(self, db_name):
+        self._bump(db_name)
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] == db_name]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_all(self):
+        self._bump('*')
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+QUERY_CACHE = QueryResultCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL)
+
+def invalidate_after_write(db_name, query):
+    """Drop cached results a finished write may have made stale"""
+    if QUALIFIED_NAME_RE.search(STRING_LITERAL_RE.sub("''", query)):
+        QUERY_CACHE.invalidate_all()
+    else:
+        QUERY_CACHE.invalidate_db(db_name)
+
+def bounded_int(value, default, low, high):
+    try:
+        return min(max(int(value), low), high)
+    except (TypeError, ValueError):
+        return default
+
 @app.route('/query_shared_db', methods=['POST'])
 @root_required
 def query_shared_db():
     db_name = request.json.get('db_name')
     query = request.json.get('query')
+    fmt = request.json.get('format', 'table')
+    limit = bounded_int(request.json.get('limit'), QUERY_DEFAULT_LIMIT, 1, QUERY_MAX_LIMIT)
+    offset = bounded_int(request.json.get('offset', request.json.get('cursor')), 0, 0, 2 ** 62)
+    timeout = bounded_int(request.json.get('timeout'), QUERY_DEFAULT_TIMEOUT, 1, QUERY_MAX_TIMEOUT)
     
     # Security: Validate database name
     if not is_safe_input(db_name):
@@ -507,38 +3443,217 @@ def query_shared_db():
     # Security: Validate SQL query - only allow safe operations
     if not is_safe_sql_query(query):
         return jsonify({"status": "error", "message": "Query not allowed. Only SELECT, INSERT, UPDATE, DELETE, SHOW, DESCRIBE are permitted"}), 400
+
+    if fmt not in ('table', 'json', 'ndjson'):
+        return jsonify({"status": "error", "message": "Invalid format. Use table, json or ndjson"}), 400
+
+    read_only = READ_ONLY_QUERY_RE.match(query) is not None
+
+    if fmt == 'ndjson':
+        def generate():
+            try:
+                for kind, value in iter_shared_query(db_name, query, limit, offset, timeout):
+                    if kind == 'columns':
+                        yield json.dumps({"type": "columns", "columns": value}) + '\n'
+                    elif kind == 'row':
+                        yield json.dumps({"type": "row", "values": value}) + '\n'
+                    else:
+                        yield json.dumps(dict(value, type="stats")) + '\n'
+            except Exception as e:
+                message = f"Query timed out after {timeout}s" if is_statement_timeout(e) else "Query execution failed"
+                yield json.dumps({"type": "error", "message": message}) + '\n'
+            finally:
+                if not read_only:
+                    invalidate_after_write(db_name, query)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
     
+    cacheable = read_only and request.json.get('cache', True) and not VOLATILE_QUERY_RE.search(query)
+    cache_key = (db_name, normalize_query(query), limit, offset)
     try:
-        result = subprocess.run(['mysql', '-t', db_name, '-e', query], capture_output=True, text=True, check=True)
-        return jsonify({"status": "success", "result": result.stdout})
-    except subprocess.CalledProcessError as e:
+        generation = QUERY_CACHE.generation(db_name) if cacheable else None
+        cached = QUERY_CACHE.get(cache_key, generation) if cacheable else None
+        if cached is not None:
+            columns, rows, stats = cached
+        else:
+            columns, rows, stats = None, [], {}
+            try:
+                for kind, value in iter_shared_query(db_name, query, limit, offset, timeout):
+                    if kind == 'columns':
+                        columns = value
+                    elif kind == 'row':
+                        rows.append(value)
+                    else:
+                        stats = value
+            finally:
+                # Only once the write has committed; a read that overlapped it cannot re-cache old rows
+                if not read_only:
+                    invalidate_after_write(db_name, query)
+            if cacheable:
+                QUERY_CACHE.put(cache_key, db_name, (columns, rows, stats), generation)
+        response = {
+            "status": "success",
+            "columns": columns or [],
+            "rows": rows,
+            "stats": stats,
+            "next_offset": stats.get('next_offset'),
+            "cached": cached is not None
+        }
+        if fmt == 'table':
+            response["result"] = format_ascii_table([c['name'] for c in columns], rows) if columns else ''
+        return jsonify(response)
+    except Exception as e:
+        if is_statement_timeout(e):
+            return jsonify({"status": "error", "message": f"Query timed out after {timeout}s"}), 504
         return jsonify({"status": "error", "message": "Query execution failed"}), 500
 
+@app.route('/db_growth', methods=['GET'])
+def db_growth_route():
+    window = bounded_int(request.args.get('window'), 7 * 86400, 60, 366 * 86400)
+    top = bounded_int(request.args.get('top'), 10, 1, 1000)
+    return jsonify(dict(db_growth(window, top), status="success"))
+
+@app.route('/query_cache_stats', methods=['GET'])
+def query_cache_stats():
+    return jsonify(dict(QUERY_CACHE.stats(), status="success"))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of request/operation latencies plus pool, job and cache state"""
+    pool = DB_POOL.stats()
+    cache = QUERY_CACHE.stats()
+    job_states = dict(state_db().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+    with SSH_UPDATE_STATE_LOCK:
+        ssh_pending = SSH_UPDATE_STATE['pending']
+    gauges = [
+        ('user_manager_db_pool_connections', {'state': 'in_use'}, pool['in_use']),
+        ('user_manager_db_pool_connections', {'state': 'idle'}, pool['idle']),
+        ('user_manager_query_cache_bytes', {}, cache['bytes']),
+        ('user_manager_query_cache_lookups', {'result': 'hit'}, cache['hits']),
+        ('user_manager_query_cache_lookups', {'result': 'miss'}, cache['misses']),
+        ('user_manager_ssh_updates_pending', {}, ssh_pending),
+        ('user_manager_quarantine_pending', {}, len(quarantined_entries())),
+        ('user_manager_event_clients', {}, len(EVENT_SUBSCRIBERS))
+    ]
+    gauges.extend(('user_manager_jobs', {'state': state}, count) for state, count in job_states.items())
+    return Response(METRICS.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # Clients poll with ?since=<number of results already seen> to get only new results
+    since = request.args.get('since', default=0, type=int)
+    view = get_job_view(job_id, since)
+    if view is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    view['percent'] = 100.0 if view['state'] == 'completed' else (
+        round(100.0 * view['completed'] / view['total'], 1) if view['total'] else 0.0)
+    return jsonify(view)
+
+@app.route('/ssh_update_status', methods=['GET'])
+def ssh_update_status():
+    with SSH_UPDATE_STATE_LOCK:
+        state = {k: v for k, v in SSH_UPDATE_STATE.items() if k != 'timer'}
+    return jsonify(dict(state, status="success", window_seconds=SSH_UPDATE_WINDOW))
+
 @app.route('/get_shared_dbs', methods=['GET'])
 def get_shared_dbs():
-    data = load_data()
-    return jsonify({"shared_dbs": data.get('shared_dbs', [])})
+    return jsonify({"shared_dbs": list_shared_dbs()})
+
+@app.route('/shared_db_access', methods=['GET'])
+def shared_db_access():
+    """Users granted access to one shared database"""
+    db_name = request.args.get('db_name', '')
+    if not is_safe_input(db_name):
+        return jsonify({"status": "error", "message": "Invalid database name format"}), 400
+    return jsonify({"status": "success", "db_name": db_name, "users": users_with_access(db_name)})
 
 @app.route('/get_logs', methods=['GET'])
 def get_logs_route():
-    return jsonify({"logs": get_logs()})
+    limit = min(max(request.args.get('limit', default=50, type=int), 1), 1000)
+    # Time range bounds are 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'
+    until = request.args.get('until') or None
+    logs, next_cursor = get_logs(
+        limit=limit,
+        cursor=request.args.get('cursor', type=int),
+        action=request.args.get('action') or None,
+        username=request.args.get('username') or None,
+        since=request.args.get('since') or None,
+        until=until + ' 23:59:59' if until and len(until) == 10 else until
+    )
+    return jsonify({"logs": logs, "next_cursor": next_cursor})
 
 @app.route('/export_csv', methods=['GET'])
 def export_csv():
-    user_details = get_user_details()
-    output = StringIO()
+    user_details, etag, _ = get_inventory_snapshot()
     # Security: Never export passwords
-    output.write("Username,Database Size,Locked\n")
+    return conditional_response(f"csv-{etag}", lambda: export_response(user_details, 'csv', EXPORT_DEFAULT_COLUMNS))
+
+# Streaming export: columns that can be selected with ?columns=
+EXPORT_COLUMN_LABELS = {
+    'username': 'Username',
+    'db_size': 'Database Size',
+    'locked': 'Locked',
+    'shared_db_grants': 'Shared DB Grants'
+}
+EXPORT_DEFAULT_COLUMNS = ['username', 'db_size', 'locked']
+
+def iter_user_details():
+    """Inventory rows built one at a time straight from passwd and shadow"""
+    db_sizes = get_sampled_db_sizes()
+    locked_users = get_locked_users()
+    with timed('file', 'passwd'):
+        entries = pwd.getpwall()
+    for p in sorted(entries, key=lambda p: p.pw_name):
+        if p.pw_name != 'root' and is_listed_account(p):
+            yield {
+                'username': p.pw_name,
+                'password': '****',  # Never expose passwords
+                'db_size': db_sizes.get(p.pw_name, "0 MB"),
+                'locked': p.pw_name in locked_users
+            }
+
+def iter_export_rows(user_details, columns):
+    """Yield one export row per user, resolving optional columns lazily"""
+    grants = get_shared_db_grants() if 'shared_db_grants' in columns else {}
     for user in user_details:
-        output.write(f"{user['username']},{user['db_size']},{user['locked']}\n")
-    
-    from io import BytesIO
-    mem = BytesIO()
-    mem.write(output.getvalue().encode('utf-8'))
-    mem.seek(0)
-    output.close()
-    
-    return send_file(mem, mimetype='text/csv', as_attachment=True, download_name='users.csv')
+        row = dict(user, shared_db_grants=grants.get(user['username'], []))
+        yield {column: row[column] for column in columns}
+
+def export_response(user_details, fmt, columns):
+    """Stream the export row by row instead of building the file in memory"""
+    def generate_csv():
+        buffer = StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow([EXPORT_COLUMN_LABELS[c] for c in columns])
+        for row in iter_export_rows(user_details, columns):
+            writer.writerow([';'.join(v) if isinstance(v, list) else v for v in row.values()])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_ndjson():
+        for row in iter_export_rows(user_details, columns):
+            yield json.dumps(row) + '\n'
+
+    if fmt == 'ndjson':
+        body, mimetype, filename = generate_ndjson(), 'application/x-ndjson', 'users.ndjson'
+    else:
+        body, mimetype, filename = generate_csv(), 'text/csv', 'users.csv'
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/export', methods=['GET'])
+def export_users():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"status": "error", "message": "Invalid format. Use csv or ndjson"}), 400
+    columns = [c for c in request.args.get('columns', '').split(',') if c] or EXPORT_DEFAULT_COLUMNS
+    unknown = [c for c in columns if c not in EXPORT_COLUMN_LABELS]
+    if unknown:
+        return jsonify({"status": "error", "message": f"Unknown columns: {', '.join(unknown)}"}), 400
+    # Security: Never export passwords
+    # Rows are built as they are sent, not collected into an inventory snapshot first
+    return export_response(iter_user_details(), fmt, columns)
 
 def detect_mariadb_config():
     """Detect MariaDB configuration file location"""
@@ -573,7 +3688,7 @@ def set_ip_range():
     try:
         bind_addr = '0.0.0.0' if not ip_range else ip_range
         
-        with open(mariadb_conf, 'r') as f:
+        with timed('file', 'mariadb_conf'), open(mariadb_conf, 'r') as f:
             lines = f.readlines()
         
         new_lines = []
@@ -591,16 +3706,328 @@ def set_ip_range():
                     new_lines.insert(i + 1, f'bind-address = {bind_addr}\n')
                     break
         
-        with open(mariadb_conf, 'w') as f:
+        with timed('file', 'mariadb_conf'), open(mariadb_conf, 'w') as f:
             f.writelines(new_lines)
         
-        subprocess.run(['systemctl', 'restart', 'mariadb'], check=True)
+        run_command(['systemctl', 'restart', 'mariadb'], check=True)
+        # Pooled connections did not survive the restart
+        DB_POOL.close_all()
         log_action('set_ip_range', ip_range or 'all', 'success')
         return jsonify({"status": "success", "message": f"IP range set to {bind_addr}"})
     except Exception as e:
         log_action('set_ip_range', ip_range or 'all', 'failed')
         return jsonify({"status": "error", "message": "Operation failed"}), 500
 
+# Multi-host fan-out: the same operations on every DB server of an Ansible-style inventory
+# (e.g. inventory_test.ini). Each host is reached over one multiplexed SSH connection
+# (ControlMaster) and runs one generated shell script per operation.
+HOSTS_FILE = os.environ.get('USER_MANAGER_HOSTS_FILE', '')
+HOSTS_GROUP = os.environ.get('USER_MANAGER_HOSTS_GROUP', 'myhosts')
+HOST_SSH_USER = os.environ.get('USER_MANAGER_HOST_SSH_USER', 'root')
+HOST_CONTROL_DIR = os.environ.get('USER_MANAGER_HOST_CONTROL_DIR', '/run/user_manager_ssh')
+HOST_CONCURRENCY = int(os.environ.get('USER_MANAGER_HOST_CONCURRENCY', '2'))  # Operations per host at once
+HOST_WORKERS = int(os.environ.get('USER_MANAGER_HOST_WORKERS', '16'))
+HOST_COMMAND_TIMEOUT = float(os.environ.get('USER_MANAGER_HOST_TIMEOUT', '600'))
+HOST_EXECUTOR = ThreadPoolExecutor(max_workers=HOST_WORKERS, thread_name_prefix='user-manager-host')
+HOSTS_LOCK = threading.Lock()
+HOSTS_CACHE = {'stamp': None, 'hosts': {}}
+
+class RemoteHost:
+    """One inventory host, reached through a persistent SSH master connection"""
+
+    def __init__(self, name, address, user, port, key_file):
+        self.name = name
+        self.address = address
+        self.user = user
+        self.port = port
+        self.key_file = key_file
+        self._slots = threading.BoundedSemaphore(HOST_CONCURRENCY)
+
+    def ssh_command(self, *extra):
+        command = ['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=10',
+                   '-o', 'ControlMaster=auto', '-o', f'ControlPath={HOST_CONTROL_DIR}/%C',
+                   '-o', 'ControlPersist=600', '-p', str(self.port)]
+        if self.key_file:
+            command += ['-i', self.key_file]
+        return command + list(extra) + [f'{self.user}@{self.address}']
+
+    def run_script(self, script):
+        """Run a shell script on the host; it is sent on stdin so passwords never appear in argv"""
+        os.makedirs(HOST_CONTROL_DIR, mode=0o700, exist_ok=True)
+        remote = ['sh', '-s'] if self.user == 'root' else ['sudo', '-n', 'sh', '-s']
+        with self._slots:
+            result = run_command(self.ssh_command() + remote, input=script, capture_output=True,
+                                 text=True, timeout=HOST_COMMAND_TIMEOUT)
+        # 255 is ssh's own failure (unreachable, auth); anything else came from the script
+        if result.returncode == 255:
+            raise ConnectionError(result.stderr.strip() or f"ssh to {self.address} failed")
+        return result.stdout
+
+    def is_connected(self):
+        result = run_command(self.ssh_command('-O', 'check'), capture_output=True, text=True)
+        return result.returncode == 0
+
+    def disconnect(self):
+        run_command(self.ssh_command('-O', 'exit'), capture_output=True)
+
+def parse_host_inventory(path, group):
+    """Hosts of one group in an Ansible INI inventory: {name: RemoteHost}"""
+    hosts, group_vars, section = [], {}, None
+    with open(path, 'r') as f:
+        for raw in f:
+            line = raw.split('#', 1)[0].split(';', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                section = line.strip('[]')
+                continue
+            if section == group:
+                name, *pairs = line.split()
+                hosts.append((name, dict(pair.split('=', 1) for pair in pairs if '=' in pair)))
+            elif section == f'{group}:vars' and '=' in line:
+                key, value = line.split('=', 1)
+                group_vars[key.strip()] = value.strip()
+    result = {}
+    for name, host_vars in hosts:
+        options = dict(group_vars, **host_vars)
+        # Same per-host key that create_users.yml installs
+        default_key = os.path.expanduser(f"~/.ssh/id_rsa_ansible_{name.replace('.', '_')}")
+        result[name] = RemoteHost(
+            name,
+            options.get('ansible_host', name),
+            options.get('ansible_user', HOST_SSH_USER),
+            int(options.get('ansible_port', 22)),
+            options.get('ansible_ssh_private_key_file') or (default_key if os.path.exists(default_key) else None)
+        )
+    return result
+
+def get_remote_hosts():
+    """Inventory hosts, re-read when the inventory file changes"""
+    if not HOSTS_FILE or not os.path.exists(HOSTS_FILE):
+        return {}
+    stamp = os.stat(HOSTS_FILE).st_mtime_ns
+    with HOSTS_LOCK:
+        if HOSTS_CACHE['stamp'] != stamp:
+            HOSTS_CACHE['hosts'] = parse_host_inventory(HOSTS_FILE, HOSTS_GROUP)
+            HOSTS_CACHE['stamp'] = stamp
+        return dict(HOSTS_CACHE['hosts'])
+
+def selected_hosts():
+    """Hosts named in ?hosts=a,b (all inventory hosts when omitted); raises KeyError for unknown names"""
+    hosts = get_remote_hosts()
+    names = [n for n in request.args.get('hosts', '').split(',') if n]
+    if not names:
+        return list(hosts.values())
+    unknown = [n for n in names if n not in hosts]
+    if unknown:
+        raise KeyError(', '.join(unknown))
+    return [hosts[n] for n in names]
+
+def fan_out(hosts, operation, progress=None):
+    """Run `operation(host)` on every host in parallel: {host name: result dict}"""
+    futures = {HOST_EXECUTOR.submit(operation, host): host for host in hosts}
+    results = {}
+    for future in as_completed(futures):
+        host = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"status": "error", "message": str(e), "results": []}
+        results[host.name] = result
+        if progress:
+            progress([dict(result, host=host.name)])
+    return dict(sorted(results.items()))
+
+def fan_out_response(results):
+    failed = [name for name, r in results.items() if r.get('status') != 'success']
+    return {
+        "status": "error" if failed else "success",
+        "message": f"Failed on: {', '.join(failed)}" if failed else f"Completed on {len(results)} host(s)",
+        "hosts": results
+    }
+
+def render_sql(statement):
+    """Inline the arguments of a (sql, args) statement for the remote mysql client"""
+    if not isinstance(statement, tuple):
+        return statement
+    sql, args = statement
+    return sql % tuple("'" + pymysql.converters.escape_string(str(a)) + "'" for a in args)
+
+def shell_quote(value):
+    return "'" + str(value).replace("'", "'\"'\"'") + "'"
+
+# Shared prologue: report lines are "RESULT<TAB>user<TAB>status<TAB>message"
+REMOTE_SCRIPT_HEADER = r"""
+report() { printf 'RESULT\t%s\t%s\t%s\n' "$1" "$2" "$(printf '%s' "$3" | tr '\t\n' '  ')"; }
+"""
+
+# Same AllowUsers rule as get_system_users(); the first AllowUsers line is replaced in place
+REMOTE_SSH_UPDATE = r"""
+allowed="AllowUsers $(getent passwd | awk -F: '$1 == "root" || ($3 >= 1000 && $7 != "/sbin/nologin" && $7 != "/bin/false") {print $1}' | sort | tr '\n' ' ' | sed 's/ *$//')"
+current=$(grep -m1 '^[[:space:]]*AllowUsers' /etc/ssh/sshd_config | tr -s ' \t' ' ' | sed 's/^ //;s/ $//')
+if [ "$current" != "$allowed" ]; then
+    awk -v line="$allowed" '/^[[:space:]]*AllowUsers/ { if (!done) print line; done = 1; next } { print } END { if (!done) print "\n" line }' \
+        /etc/ssh/sshd_config > /etc/ssh/sshd_config.tmp && mv /etc/ssh/sshd_config.tmp /etc/ssh/sshd_config \
+        && { systemctl reload sshd || systemctl restart sshd; } >/dev/null 2>&1 \
+        && report - success "SSH permissions updated." || report - error "SSH permissions update failed."
+fi
+"""
+
+def remote_sql_step(statements, success, user):
+    sql = '\n'.join(render_sql(s) + ';' for s in statements)
+    return (f"if out=$(mysql 2>&1 <<'__SQL__'\n{sql}\n__SQL__\n); "
+            f"then report {user} success {shell_quote(success)}; else report {user} error \"$out\"; fi\n")
+
+def remote_provision_script(roster):
+    lines = [REMOTE_SCRIPT_HEADER]
+    for username, password in roster:
+        user = shell_quote(username)
+        lines.append(
+            f"if getent passwd {user} >/dev/null; then report {user} warning \"SSH user '{username}' already exists.\"; "
+            f"elif out=$(useradd -m -s /bin/bash {user} 2>&1) && out=$(printf '%s\\n' {shell_quote(f'{username}:{password}')} | chpasswd 2>&1); "
+            f"then report {user} success \"SSH user '{username}' created.\"; else report {user} error \"$out\"; fi\n")
+        lines.append(f"if getent passwd {user} >/dev/null; then\n")
+        lines.append(remote_sql_step(create_user_statements(username, password),
+                                     f"DB user '{username}' created and restricted to database '{username}'.", user))
+        lines.append("fi\n")
+    lines.append("mysql -e 'FLUSH PRIVILEGES' >/dev/null 2>&1\n")
+    lines.append(REMOTE_SSH_UPDATE)
+    return ''.join(lines)
+
+def remote_delete_script(usernames):
+    lines = [REMOTE_SCRIPT_HEADER]
+    for username in usernames:
+        user = shell_quote(username)
+        lines.append(f"if out=$(userdel -r {user} 2>&1); then\n")
+        lines.append(remote_sql_step([f"DROP DATABASE IF EXISTS `{username}`",
+                                      ("DROP USER IF EXISTS %s@'localhost'", (username,))],
+                                     f"User {username} deleted", user))
+        lines.append(f"else report {user} error \"$out\"; fi\n")
+    lines.append("mysql -e 'FLUSH PRIVILEGES' >/dev/null 2>&1\n")
+    lines.append(REMOTE_SSH_UPDATE)
+    return ''.join(lines)
+
+def remote_lock_script(username, action):
+    flag = '-L' if action == 'lock' else '-U'
+    user = shell_quote(username)
+    return (REMOTE_SCRIPT_HEADER +
+            f"if out=$(usermod {flag} {user} 2>&1); then report {user} success {action}ed; else report {user} error \"$out\"; fi\n")
+
+REMOTE_INVENTORY_SCRIPT = r"""
+getent passwd | awk -F: '$1 == "root" || ($3 >= 1000 && $7 != "/sbin/nologin" && $7 != "/bin/false") {print "USER\t" $1}'
+awk -F: '$2 ~ /^!/ {print "LOCKED\t" $1}' /etc/shadow
+mysql -N -B -e "SELECT table_schema, SUM(data_length + index_length) FROM information_schema.TABLES GROUP BY table_schema" \
+    | awk -F'\t' '{print "SIZE\t" $1 "\t" $2}'
+"""
+
+def parse_remote_results(output):
+    """RESULT lines → list of result dicts; overall status is error if any line failed"""
+    results = []
+    for line in output.splitlines():
+        fields = line.split('\t', 3)
+        if fields[0] != 'RESULT' or len(fields) < 4:
+            continue
+        _, user, status, message = fields
+        result = {"status": status, "message": message}
+        if user != '-':
+            result['username'] = user
+        results.append(result)
+    failed = any(r['status'] == 'error' for r in results)
+    return {"status": "error" if failed else "success", "results": results}
+
+def remote_inventory(host):
+    users, locked, sizes = [], set(), {}
+    for line in host.run_script(REMOTE_INVENTORY_SCRIPT).splitlines():
+        fields = line.split('\t')
+        if fields[0] == 'USER':
+            users.append(fields[1])
+        elif fields[0] == 'LOCKED':
+            locked.add(fields[1])
+        elif fields[0] == 'SIZE' and len(fields) == 3:
+            sizes[fields[1]] = int(float(fields[2])) if fields[2] not in ('', 'NULL') else 0
+    user_details = build_user_details(sorted(users), {db: format_db_size(b) for db, b in sizes.items() if b}, locked)
+    return {"status": "success", "results": [], "user_details": user_details}
+
+def host_route(kind, payload, target, operation, rejected=()):
+    """Fan `operation` out to the selected hosts, as a background job with ?async=1.
+
+    `rejected` are validation errors reported alongside the per-host results.
+    """
+    try:
+        hosts = selected_hosts()
+    except KeyError as e:
+        return jsonify({"status": "error", "message": f"Unknown host(s): {e.args[0]}"}), 400
+    if not hosts:
+        return jsonify({"status": "error", "message": "No hosts configured (set USER_MANAGER_HOSTS_FILE)"}), 400
+
+    def work(progress=None):
+        results = fan_out(hosts, operation, progress)
+        log_action(kind, f"{target} on {len(hosts)} host(s)", 'completed')
+        response = fan_out_response(results)
+        if rejected:
+            response['results'] = list(rejected)
+        return response
+
+    if request_flag('async'):
+        return job_accepted(*submit_job(kind, [payload, [h.name for h in hosts]], len(hosts), work))
+    return jsonify(work())
+
+@app.route('/hosts', methods=['GET'])
+def list_hosts():
+    hosts = get_remote_hosts()
+    return jsonify({"status": "success", "hosts": [
+        {"name": h.name, "address": h.address, "user": h.user, "port": h.port, "connected": h.is_connected()}
+        for h in hosts.values()
+    ]})
+
+@app.route('/hosts/inventory', methods=['GET'])
+def hosts_inventory():
+    return host_route('host_inventory', None, 'inventory', remote_inventory)
+
+@app.route('/hosts/add_users', methods=['POST'])
+@root_required
+def hosts_add_users():
+    roster = [(u.get('username'), u.get('password')) for u in request.get_json() or []]
+    errors = validate_roster(roster)
+    valid = [entry for entry, error in zip(roster, errors) if error is None]
+    invalid = [error for error in errors if error is not None]
+    if not valid:
+        return jsonify({"status": "error", "message": "No valid users", "results": invalid}), 400
+    script = remote_provision_script(valid)
+    return host_route('host_add_users', valid, f"{len(valid)} user(s)",
+                      lambda host: parse_remote_results(host.run_script(script)), rejected=invalid)
+
+@app.route('/hosts/delete_users', methods=['POST'])
+@root_required
+def hosts_delete_users():
+    usernames = [u for u in request.json.get('usernames', []) if is_safe_input(u) and u != 'root']
+    if not usernames:
+        return jsonify({"status": "error", "message": "No valid usernames"}), 400
+    script = remote_delete_script(usernames)
+    return host_route('host_delete_users', usernames, f"{len(usernames)} user(s)",
+                      lambda host: parse_remote_results(host.run_script(script)))
+
+@app.route('/hosts/toggle_lock', methods=['POST'])
+@root_required
+def hosts_toggle_lock():
+    username = request.json.get('username')
+    action = request.json.get('action')
+    if not is_safe_input(username):
+        return jsonify({"status": "error", "message": "Invalid username format"}), 400
+    if action not in ['lock', 'unlock']:
+        return jsonify({"status": "error", "message": "Invalid action"}), 400
+    script = remote_lock_script(username, action)
+    return host_route(f'host_{action}_user', [username, action], username,
+                      lambda host: parse_remote_results(host.run_script(script)))
+
+@atexit.register
+def disconnect_remote_hosts():
+    for host in HOSTS_CACHE['hosts'].values():
+        try:
+            host.disconnect()
+        except Exception:
+            pass
+
 if __name__ == '__main__':
     print("--- User Creation Web Tool ---")
     print(f"Access at: http://<your-server-ip>:5000")
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""Measure how app.py endpoints scale with the number of users.
+
+Runs the Flask app in-process against fake system binaries (see
+shims/fake_command.sh) and a fake MariaDB connection, so it needs neither
+root nor a database server. For each user count it reports latency,
+subprocess count, database statements and peak Python memory.
+
+    python3 benchmarks/bench_app.py
+    python3 benchmarks/bench_app.py --sizes 10,100 --latency 0.005 --db-latency 0.0005
+    python3 benchmarks/bench_app.py --json bench.json --baseline previous.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pwd
+import sys
+import tempfile
+import time
+import types
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SHIM_SCRIPT = os.path.join(BENCH_DIR, 'shims', 'fake_command.sh')
+SHIM_COMMANDS = ['useradd', 'userdel', 'newusers', 'chpasswd', 'passwd', 'usermod', 'mysql', 'systemctl']
+
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+class FakeCursor:
+    """Cursor that answers the app's read queries with empty results"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self.rowcount = 0
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, sql, args=None):
+        self.conn.stats['db_statements'] += 1
+        if self.conn.latency:
+            time.sleep(self.conn.latency)
+        head = sql.lstrip().split(None, 1)[0].upper()
+        if head in ('SELECT', 'SHOW'):
+            self.description = [('value', 253, None, None, None, None, True)]
+        else:
+            self.description = None
+        self._rows = []
+        return 0
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchall_unbuffered(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Stand-in for a PyMySQL connection with a fixed per-statement latency"""
+
+    def __init__(self, stats, latency):
+        self.stats = stats
+        self.latency = latency
+        self.is_mariadb = True
+        self.statement_timeout = None
+        self.current_db = None
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def select_db(self, db):
+        pass
+
+    def ping(self, reconnect=False):
+        pass
+
+    def thread_id(self):
+        return 1
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePwd:
+    """pwd replacement backed by the shims' fake passwd file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def getpwall(self):
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                name, passwd, uid, gid, gecos, home, shell = line.rstrip('\n').split(':')
+                entries.append(pwd.struct_passwd((name, passwd, int(uid), int(gid), gecos, home, shell)))
+        return entries
+
+    def getpwnam(self, name):
+        for entry in self.getpwall():
+            if entry.pw_name == name:
+                return entry
+        raise KeyError(name)
+
+
+def setup_environment(workdir, latency, db_latency):
+    """Point app.py at the shims and temporary state files; returns (app module, stats).
+
+    Every path the app writes to (state, logs, backups, SSH sockets, home directories)
+    lives under workdir.
+    """
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir)
+    for command in SHIM_COMMANDS:
+        os.symlink(SHIM_SCRIPT, os.path.join(bin_dir, command))
+
+    paths = {name: os.path.join(workdir, name)
+             for name in ('passwd', 'shadow', 'shim.log', 'sshd_config', 'home', 'mail', 'backups', 'ssh_control')}
+    os.makedirs(paths['home'])
+    os.makedirs(paths['mail'])
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    os.environ['BENCH_PASSWD'] = paths['passwd']
+    os.environ['BENCH_SHADOW'] = paths['shadow']
+    os.environ['BENCH_SHIM_LOG'] = paths['shim.log']
+    os.environ['BENCH_HOME'] = paths['home']
+    os.environ['BENCH_LATENCY'] = str(latency)
+    os.environ['USER_MANAGER_STATE_DB'] = os.path.join(workdir, 'state.db')
+    os.environ['USER_MANAGER_SLOW_OP_LOG'] = os.path.join(workdir, 'slow_ops.log')
+    os.environ['USER_MANAGER_BACKUP_DIR'] = paths['backups']
+    os.environ['USER_MANAGER_HOST_CONTROL_DIR'] = paths['ssh_control']
+
+    import app as app_module
+
+    stats = {'db_statements': 0}
+    app_module.DB_POOL.close_all()
+    app_module.DB_POOL.connect = lambda: FakeConnection(stats, db_latency)
+    app_module.pwd = FakePwd(paths['passwd'])
+    app_module.PASSWD_FILE = paths['passwd']
+    app_module.SHADOW_FILE = paths['shadow']
+    app_module.SSHD_CONFIG_FILE = paths['sshd_config']
+    app_module.DATA_FILE = os.path.join(workdir, 'data.json')
+    app_module.STATE_DB_FILE = os.path.join(workdir, 'state.db')
+    app_module.LOG_FILE = os.path.join(workdir, 'actions.log')
+    app_module.LOG_DIR = os.path.join(workdir, 'audit')
+    app_module.DB_SIZE_HISTORY_FILE = os.path.join(workdir, 'db_sizes.jsonl')
+    # Set again here in case app was imported before the environment above
+    app_module.SLOW_OP_LOG = os.environ['USER_MANAGER_SLOW_OP_LOG']
+    app_module.BACKUP_DIR = paths['backups']
+    app_module.HOST_CONTROL_DIR = paths['ssh_control']
+    app_module.MAIL_SPOOL_DIR = paths['mail']
+    app_module.REAPER_STATE['dirs'] = {os.path.join(paths['home'], app_module.QUARANTINE_DIR_NAME)}
+    app_module.DB_SIZE_SAMPLE_INTERVAL = 3600
+    app_module.SSH_UPDATE_WINDOW = 0.01
+    # The app checks for root before mutating anything; the shims don't need it. Only app.py's
+    # view of os is changed, not the os module the rest of the process uses
+    app_module.os = types.SimpleNamespace(**vars(os))
+    app_module.os.geteuid = lambda: 0
+    return app_module, stats, paths
+
+
+def reset_state(paths, usernames=()):
+    """Start a scenario with exactly these users present"""
+    with open(paths['passwd'], 'w') as passwd, open(paths['shadow'], 'w') as shadow:
+        passwd.write('root:x:0:0:root:/root:/bin/bash\n')
+        shadow.write('root:*:20000:0:99999:7:::\n')
+        for i, name in enumerate(usernames):
+            passwd.write(f"{name}:x:{2000 + i}:{2000 + i}::{os.path.join(paths['home'], name)}:/bin/bash\n")
+            shadow.write(f'{name}:$6$bench$hash:20000:0:99999:7:::\n')
+    with open(paths['sshd_config'], 'w') as f:
+        f.write('Port 22\nAllowUsers root\n')
+    open(paths['shim.log'], 'w').close()
+
+
+def shim_calls(paths):
+    with open(paths['shim.log']) as f:
+        return sum(1 for _ in f)
+
+
+def measure(app_module, stats, paths, client, endpoint, call):
+    """Run one request and collect latency, subprocesses, DB statements and peak memory"""
+    app_module.invalidate_inventory(db_sizes=True)
+    calls_before = shim_calls(paths)
+    statements_before = stats['db_statements']
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    response = call(client)
+    body = response.get_data()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    app_module.flush_ssh_updates()
+    if response.status_code >= 400:
+        raise RuntimeError(f"{endpoint} returned {response.status_code}: {body[:200]!r}")
+    return {
+        'endpoint': endpoint,
+        'latency_ms': round(elapsed * 1000, 1),
+        'subprocesses': shim_calls(paths) - calls_before,
+        'db_statements': stats['db_statements'] - statements_before,
+        'peak_memory_kb': round(peak / 1024, 1),
+        'response_bytes': len(body)
+    }
+
+
+def run_size(app_module, stats, paths, client, size, bulk):
+    users = [f'bench{i:05d}' for i in range(size)]
+    roster = [{'username': u, 'password': 'Bench_pw1'} for u in users]
+    query = '?bulk=1' if bulk else ''
+    results = []
+
+    reset_state(paths)
+    results.append(measure(app_module, stats, paths, client, '/add_users',
+                           lambda c: c.post('/add_users' + query, json=roster)))
+
+    reset_state(paths)
+    upload = json.dumps({u: 'Bench_pw1' for u in users}).encode('utf-8')
+    results.append(measure(app_module, stats, paths, client, '/upload_users_file',
+                           lambda c: c.post('/upload_users_file' + query,
+                                            data={'file': (io.BytesIO(upload), 'users.json')},
+                                            content_type='multipart/form-data')))
+
+    reset_state(paths, users)
+    results.append(measure(app_module, stats, paths, client, '/', lambda c: c.get('/')))
+    results.append(measure(app_module, stats, paths, client, '/export_csv', lambda c: c.get('/export_csv')))
+    results.append(measure(app_module, stats, paths, client, '/delete_multiple',
+                           lambda c: c.post('/delete_multiple', json={'usernames': users})))
+
+    for result in results:
+        result['users'] = size
+    return results
+
+
+def print_report(results, out):
+    header = f"{'endpoint':<20} {'users':>6} {'latency_ms':>11} {'subprocs':>9} {'db_stmts':>9} {'peak_kb':>9}"
+    print(header, file=out)
+    print('-' * len(header), file=out)
+    for r in results:
+        print(f"{r['endpoint']:<20} {r['users']:>6} {r['latency_ms']:>11} {r['subprocesses']:>9} "
+              f"{r['db_statements']:>9} {r['peak_memory_kb']:>9}", file=out)
+
+
+def compare_to_baseline(results, baseline_path, max_ratio):
+    """Regressions where latency or command counts grew beyond max_ratio of the baseline"""
+    with open(baseline_path) as f:
+        baseline = {(r['endpoint'], r['users']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['endpoint'], r['users']))
+        if not base:
+            continue
+        for metric in ('latency_ms', 'subprocesses', 'db_statements'):
+            # Small absolute values are noise, not regressions
+            if r[metric] > max(base[metric] * max_ratio, base[metric] + 5):
+                regressions.append(f"{r['endpoint']} @ {r['users']} users: {metric} {base[metric]} -> {r[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000,5000', help='comma-separated user counts')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fake command')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='seconds added to every SQL statement')
+    parser.add_argument('--per-user', action='store_true', help='use the per-user path instead of ?bulk=1')
+    parser.add_argument('--json', help='also write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=1.5, help='allowed growth factor vs. baseline')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    with tempfile.TemporaryDirectory(prefix='user-manager-bench-') as workdir:
+        app_module, stats, paths = setup_environment(workdir, args.latency, args.db_latency)
+        client = app_module.app.test_client()
+        tracemalloc.start()
+        results = []
+        # Keep the app's own progress prints out of the report
+        with contextlib.redirect_stdout(sys.stderr):
+            for size in sizes:
+                print(f"[*] Benchmarking with {size} users...")
+                results.extend(run_size(app_module, stats, paths, client, size, bulk=not args.per_user))
+        tracemalloc.stop()
+
+    print_report(results, sys.stdout)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'latency': args.latency, 'db_latency': args.db_latency,
+                       'bulk': not args.per_user, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        for line in regressions:
+            print(f"[!] Regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
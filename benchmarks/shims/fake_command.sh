@@ -0,0 +1,77 @@
+#!/bin/sh
+# Stand-in for the system binaries app.py calls (useradd, userdel, chpasswd, ...).
+# bench_app.py links each command name to this script in a directory it puts
+# first on PATH. Every call is recorded in $BENCH_SHIM_LOG, delayed by the
+# configured latency, and applied to the fake $BENCH_PASSWD / $BENCH_SHADOW files.
+# New users get home directories under $BENCH_HOME, never under /home.
+
+name=$(basename "$0")
+printf '%s %s\n' "$name" "$*" >> "$BENCH_SHIM_LOG"
+
+# Per-command latency (e.g. BENCH_LATENCY_USERADD=0.05) falls back to BENCH_LATENCY
+upper=$(printf '%s' "$name" | tr 'a-z' 'A-Z')
+eval "latency=\${BENCH_LATENCY_$upper:-${BENCH_LATENCY:-0}}"
+if [ "$latency" != "0" ]; then
+    sleep "$latency"
+fi
+
+# Last argument is the username for useradd/userdel/usermod/passwd
+for last; do :; done
+
+add_user() {
+    if grep -q "^$1:" "$BENCH_PASSWD"; then
+        echo "useradd: user '$1' already exists" >&2
+        return 9
+    fi
+    uid=$((1000 + $(wc -l < "$BENCH_PASSWD")))
+    echo "$1:x:$uid:$uid::$BENCH_HOME/$1:/bin/bash" >> "$BENCH_PASSWD"
+    echo "$1:!:20000:0:99999:7:::" >> "$BENCH_SHADOW"
+}
+
+set_password() {
+    sed -i "s|^$1:[^:]*:|$1:\$6\$bench\$hash:|" "$BENCH_SHADOW"
+}
+
+case "$name" in
+    useradd)
+        add_user "$last" || exit $?
+        ;;
+    newusers)
+        while IFS=: read -r user _rest; do
+            add_user "$user" || exit $?
+            set_password "$user"
+        done
+        ;;
+    userdel)
+        grep -q "^$last:" "$BENCH_PASSWD" || { echo "userdel: user '$last' does not exist" >&2; exit 6; }
+        sed -i "/^$last:/d" "$BENCH_PASSWD" "$BENCH_SHADOW"
+        ;;
+    chpasswd)
+        while IFS=: read -r user _rest; do
+            set_password "$user"
+        done
+        ;;
+    usermod)
+        case "$1" in
+            -L) sed -i "s|^$last:\([^!]\)|$last:!\1|" "$BENCH_SHADOW" ;;
+            -U) sed -i "s|^$last:!|$last:|" "$BENCH_SHADOW" ;;
+        esac
+        ;;
+    passwd)
+        if grep -q "^$last:!" "$BENCH_SHADOW"; then
+            echo "$last L 01/01/2025 0 99999 7 -1"
+        else
+            echo "$last P 01/01/2025 0 99999 7 -1"
+        fi
+        ;;
+    mysql)
+        # Scripts arrive on stdin unless passed with -e
+        case " $* " in
+            *" -e "*) ;;
+            *) cat > /dev/null ;;
+        esac
+        ;;
+    systemctl)
+        ;;
+esac
+exit 0
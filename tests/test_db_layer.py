@@ -0,0 +1,241 @@
+"""Tests for the pooled database layer (ConnectionPool, db_execute, db_execute_groups).
+
+Most tests run against FakeConnection, a stand-in that behaves like a PyMySQL
+connection: it raises the same error classes and codes for lost connections
+and server-side errors. Set USER_MANAGER_TEST_DB=1 (plus the usual
+USER_MANAGER_DB_* variables) to also run the last test against a local
+MariaDB/MySQL server.
+
+    python3 -m pytest -q tests
+"""
+import os
+import sys
+import threading
+
+import pymysql
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, args=None):
+        if self.conn.broken:
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+        self.conn.executed.append((sql, args))
+        for fragment, error in self.conn.errors.items():
+            if fragment in sql:
+                raise error
+        if sql.startswith('SELECT'):
+            self.description = [('value', 253, None, None, None, None, True)]
+            self._rows = [(1,), (2,)]
+        else:
+            self.description = None
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+    """PyMySQL-like connection that records statements, pings and closes"""
+
+    def __init__(self, errors=None):
+        self.executed = []
+        self.errors = errors or {}
+        self.broken = False
+        self.closed = False
+        self.pings = 0
+        self.is_mariadb = True
+        self.statement_timeout = None
+        self.current_db = None
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def select_db(self, database):
+        pass
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.broken:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    def __init__(self, errors=None):
+        self.errors = errors
+        self.created = []
+
+    def __call__(self):
+        conn = FakeConnection(self.errors)
+        self.created.append(conn)
+        return conn
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    factory = Factory()
+    pool = app.ConnectionPool(factory, max_size=2, acquire_timeout=0.2, ping_interval=0)
+    pool.factory = factory
+    monkeypatch.setattr(app, 'DB_POOL', pool)
+    return pool
+
+
+def test_idle_connection_is_pinged_before_reuse(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert first.pings == 1
+    assert len(pool.factory.created) == 1
+
+
+def test_recently_used_connection_skips_ping():
+    pool = app.ConnectionPool(Factory(), max_size=1, acquire_timeout=0.2, ping_interval=60)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert first.pings == 0
+
+
+def test_broken_idle_connection_is_replaced(pool):
+    with pool.connection() as first:
+        pass
+    first.broken = True
+    with pool.connection() as second:
+        assert second is not first
+    assert first.closed
+    assert pool.stats()['idle'] == 1
+
+
+def test_connection_lost_during_use_is_discarded(pool):
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as conn:
+            conn.broken = True
+            conn.cursor().execute('SELECT 1')
+    assert conn.closed
+    assert pool.stats() == {'max_size': 2, 'idle': 0, 'in_use': 0}
+
+
+def test_server_error_keeps_connection(pool):
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as conn:
+            raise pymysql.err.OperationalError(1044, 'Access denied')
+    assert not conn.closed
+    assert pool.stats()['idle'] == 1
+
+
+def test_exhausted_pool_times_out_and_recovers(pool):
+    held = [pool.connection(), pool.connection()]
+    for ctx in held:
+        ctx.__enter__()
+    try:
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+    finally:
+        for ctx in held:
+            ctx.__exit__(None, None, None)
+    with pool.connection():
+        assert pool.stats()['in_use'] == 1
+
+
+def test_waiting_checkout_gets_released_connection(pool):
+    pool.acquire_timeout = 2
+    held = [pool.connection(), pool.connection()]
+    for ctx in held:
+        ctx.__enter__()
+    threading.Timer(0.05, held[0].__exit__, (None, None, None)).start()
+    with pool.connection():
+        pass
+    held[1].__exit__(None, None, None)
+    assert len(pool.factory.created) == 2
+
+
+def test_db_execute_returns_columns_and_rows(pool):
+    columns, rows = app.db_execute('SELECT value FROM t')
+    assert columns == ['value']
+    assert rows == [(1,), (2,)]
+    assert app.db_execute('UPDATE t SET value = 1') == (None, [])
+
+
+def test_db_execute_applies_statement_timeout_once(pool):
+    app.db_execute('SELECT 1', timeout=5)
+    app.db_execute('SELECT 2', timeout=5)
+    conn = pool.factory.created[0]
+    timeouts = [args for sql, args in conn.executed if 'max_statement_time' in sql]
+    assert timeouts == [(5,)]
+
+
+def test_admin_batches_run_without_statement_timeout(pool):
+    app.db_execute('SELECT 1')
+    app.db_execute_groups([['DROP DATABASE IF EXISTS `a`']])
+    conn = pool.factory.created[0]
+    timeouts = [args for sql, args in conn.executed if 'max_statement_time' in sql]
+    assert timeouts == [(app.DB_STATEMENT_TIMEOUT,), (0,)]
+
+
+def test_db_execute_groups_isolates_server_errors(monkeypatch):
+    factory = Factory({'`bad`': pymysql.err.ProgrammingError(1064, 'syntax error')})
+    monkeypatch.setattr(app, 'DB_POOL', app.ConnectionPool(factory, 1, 0.2, 0))
+    errors = app.db_execute_groups(
+        [['CREATE DATABASE `a`'], ['CREATE DATABASE `bad`', 'GRANT ALL ON `bad`.* TO x'], ['CREATE DATABASE `b`']],
+        final=['FLUSH PRIVILEGES'])
+    assert errors[0] is None and errors[2] is None
+    assert errors[1].args[0] == 1064
+    executed = [sql for sql, _ in factory.created[0].executed]
+    # The failing group stops at its first error; the others and the final statement still run
+    assert 'GRANT ALL ON `bad`.* TO x' not in executed
+    assert executed[-2:] == ['CREATE DATABASE `b`', 'FLUSH PRIVILEGES']
+
+
+def test_db_execute_groups_raises_and_discards_on_lost_connection(pool):
+    with pool.connection() as conn:
+        pass
+    conn.executed.clear()
+
+    original = FakeCursor.execute
+
+    def lose_connection(self, sql, args=None):
+        if 'DROP' in sql:
+            self.conn.broken = True
+        return original(self, sql, args)
+
+    FakeCursor.execute = lose_connection
+    try:
+        with pytest.raises(pymysql.err.OperationalError):
+            app.db_execute_groups([['DROP DATABASE `a`'], ['DROP DATABASE `b`']])
+    finally:
+        FakeCursor.execute = original
+    assert conn.closed
+    assert pool.stats()['idle'] == 0
+
+
+@pytest.mark.skipif(not os.environ.get('USER_MANAGER_TEST_DB'), reason='set USER_MANAGER_TEST_DB=1 to use a local server')
+def test_against_local_server(monkeypatch):
+    pool = app.ConnectionPool(app.connect_db, 2, 5, 0)
+    monkeypatch.setattr(app, 'DB_POOL', pool)
+    assert app.db_query('SELECT 1 + 1') == [(2,)]
+    errors = app.db_execute_groups([['SELECT 1'], ['SELECT * FROM no_such_db.no_such_table']])
+    assert errors[0] is None and errors[1] is not None
+    with pool.connection() as conn:
+        conn.ping(reconnect=False)
+    pool.close_all()